@@ -0,0 +1,31 @@
+# Cooperative serving mode for the LLM-bound chat endpoints.
+#
+# gevent patches sockets, threads and sleeps before anything else is imported,
+# so a request waiting on Gemini yields to other requests instead of pinning a
+# worker thread. One process can then hold hundreds of in-flight chat turns:
+#
+#     python async_server.py
+#     gunicorn -k gevent --worker-connections 1000 async_server:app
+from gevent import monkey
+monkey.patch_all()
+
+import os
+
+# Every waiting chat turn holds a Gemini call, so the client pool must be as
+# wide as the number of concurrent requests rather than the CPU count.
+os.environ.setdefault("GEMINI_POOL_SIZE", os.getenv("ASYNC_MAX_CONNECTIONS", "1000"))
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from main import app
+
+
+def serve(host="0.0.0.0", port=8080):
+    max_connections = int(os.getenv("ASYNC_MAX_CONNECTIONS", 1000))
+    server = WSGIServer((host, port), app, spawn=Pool(max_connections))
+    print(f"Serving on http://{host}:{port} (gevent, up to {max_connections} concurrent requests)")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    serve(port=int(os.getenv("PORT", 8080)))
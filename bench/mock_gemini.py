@@ -0,0 +1,208 @@
+# Offline stand-in for the Gemini REST API, for load tests and local runs.
+#
+# Serves generateContent and streamGenerateContent (alt=sse) with configurable
+# latency, injected errors and canned JSON for the structured extraction calls:
+#
+#     python bench/mock_gemini.py --port 8765 --latency lognormal:0.8,0.5 --error-rate 0.02
+#     GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta python main.py
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_WORDS = (
+    "Lovely choice! Let's think about how the space will feel day to day. "
+    "Natural light, warm textures and a calm palette would tie the room together. "
+    "What would you like to decide next for this part of the house?"
+).split()
+
+DETAIL_TYPES = [
+    'atmosphere', 'color_scheme', 'style', 'budget', 'activities', 'furniture',
+    'lighting', 'textures', 'dimensions', 'storage', 'flooring', 'wall_treatments',
+    'windows', 'decor', 'technology', 'accessibility', 'sustainability'
+]
+
+
+class Latency:
+    """Parses specs like "fixed:0.2", "uniform:0.1,0.6", "normal:0.5,0.1",
+    "lognormal:0.5,0.4" (median seconds, sigma) or "exp:0.4" (mean seconds)."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("fixed", "uniform", "normal", "lognormal", "exp"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0] if p else 0.0
+        elif self.kind == "uniform":
+            value = random.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = random.gauss(p[0], p[1])
+        elif self.kind == "lognormal":
+            value = p[0] * random.lognormvariate(0, p[1])
+        else:
+            value = random.expovariate(1 / p[0])
+        return max(0.0, value)
+
+
+def canned_json(schema):
+    properties = schema.get("properties", {})
+    if "house_details" in properties:
+        return {
+            "house_details": [{"detail_type": "architectural_style", "detail_value": "contemporary"}],
+            "rooms": ["Kitchen", "Bedroom", "Living Room"],
+            "room_details": [],
+        }
+    if "add" in properties:
+        return {"add": [], "remove": []}
+    if "details" in properties:
+        detail_type = random.choice(DETAIL_TYPES)
+        return {"details": [{"detail_type": detail_type, "detail_value": f"mock {detail_type.replace('_', ' ')}"}]}
+    return {key: [] for key in properties}
+
+
+def reply_text(words):
+    return " ".join(REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(words))
+
+
+def usage(payload, text):
+    prompt_chars = sum(len(part.get("text", "")) for content in payload.get("contents", []) for part in content.get("parts", []))
+    return {
+        "promptTokenCount": prompt_chars // 4 + 1,
+        "candidatesTokenCount": len(text) // 4 + 1,
+        "totalTokenCount": (prompt_chars + len(text)) // 4 + 2,
+    }
+
+
+class MockGemini:
+    def __init__(self, latency="fixed:0.3", error_rate=0.0, error_statuses=(503,), reply_words=40,
+                 stream_chunks=8, chunk_delay=0.02):
+        self.latency = Latency(latency) if isinstance(latency, str) else latency
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.reply_words = reply_words
+        self.stream_chunks = stream_chunks
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def respond(self, payload):
+        """Returns (status, text) after sleeping for a sampled latency."""
+        time.sleep(self.latency.sample())
+        with self.lock:
+            self.requests += 1
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return random.choice(self.error_statuses), None
+        schema = payload.get("generationConfig", {}).get("responseSchema")
+        if schema:
+            return 200, json.dumps(canned_json(schema))
+        return 200, reply_text(self.reply_words)
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            match = re.match(r"^/v1beta/models/([^:/]+):(generateContent|streamGenerateContent)", self.path)
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if not match:
+                return self._send(404, {"error": {"message": "not found"}})
+            try:
+                payload = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                return self._send(400, {"error": {"message": "invalid JSON"}})
+            status, text = mock.respond(payload)
+            if status != 200:
+                return self._send(status, {"error": {"code": status, "message": "injected error"}})
+            if match.group(2) == "generateContent":
+                return self._send(200, {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                    "usageMetadata": usage(payload, text),
+                })
+            self._stream(payload, text)
+
+        def _send(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self, payload, text):
+            # Chunked like the real API, so clients see every event as soon as it is sent
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            words = text.split(" ")
+            size = max(1, -(-len(words) // mock.stream_chunks))
+            for i in range(0, len(words), size):
+                piece = " ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+                chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}]}
+                if i + size >= len(words):
+                    chunk["usageMetadata"] = usage(payload, text)
+                self._write_chunk(f"data: {json.dumps(chunk)}\r\n\r\n".encode("utf-8"))
+                time.sleep(mock.chunk_delay)
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data):
+            # An empty chunk ends the body
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start(mock, host="127.0.0.1", port=0):
+    """Start the server on a daemon thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-gemini", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1beta"
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", default="fixed:0.3", help="latency distribution, e.g. lognormal:0.8,0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with an error")
+    parser.add_argument("--error-statuses", default="503", help="comma separated HTTP statuses to inject")
+    parser.add_argument("--reply-words", type=int, default=40, help="length of canned text replies")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="SSE chunks per streamed reply")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between SSE chunks")
+
+
+def from_arguments(args):
+    return MockGemini(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_statuses.split(",")],
+        reply_words=args.reply_words,
+        stream_chunks=args.stream_chunks,
+        chunk_delay=args.chunk_delay,
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock Gemini API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(from_arguments(args)))
+    print(f"Mock Gemini on http://{args.host}:{args.port}/v1beta (latency {args.latency}, error rate {args.error_rate})")
+    server.serve_forever()
@@ -0,0 +1,264 @@
+# End-to-end latency benchmark for the chat, room and report flows.
+#
+# Each virtual user registers, sets up a project through the setup chat,
+# confirms and finalizes its rooms, chats in a room and generates a report.
+# By default the Flask app runs in-process against a fresh database and the
+# mock Gemini server; pass --target to drive a running deployment instead
+# (point its GEMINI_BASE_URL at bench/mock_gemini.py to keep it offline).
+#
+#     python bench/run.py --users 50 --concurrency 10 --latency lognormal:0.8,0.5
+#     python bench/run.py --target http://127.0.0.1:8080 --users 200 --concurrency 50 --json results.json
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_gemini
+
+SETUP_MESSAGES = [
+    "2 floors, north facing, 1200 sq ft plot",
+    "I'd like a warm contemporary house that feels open and bright",
+    "kitchen, master bedroom, living room and office",
+]
+ROOM_MESSAGES = [
+    "Kitchen: oak flooring, pendant lights, open shelves",
+    "I want it to feel like a calm retreat where we can read together in the evenings",
+    "cozy",
+    "Something with soft natural textures and plenty of daylight",
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, label, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(label, []).append((seconds, ok))
+
+    def timed(self, label, call):
+        start = time.perf_counter()
+        try:
+            status, body = call()
+        except Exception:
+            self.record(label, time.perf_counter() - start, False)
+            raise
+        self.record(label, time.perf_counter() - start, status < 400)
+        return status, body
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class AppClient:
+    """Drives the Flask app in-process through its test client."""
+
+    def __init__(self, app, recorder):
+        self.client = app.test_client()
+        self.recorder = recorder
+
+    def post(self, path, json=None, data=None):
+        response = self.client.post(path, json=json, data=data)
+        return response.status_code, response.get_data()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.get_data()
+
+    def stream(self, path, json, label):
+        start = time.perf_counter()
+        response = self.client.post(path, json=json, buffered=False)
+        body = b""
+        for chunk in response.iter_encoded():
+            if not body:
+                self.recorder.record(f"{label} (first byte)", time.perf_counter() - start, response.status_code < 400)
+            body += chunk
+        response.close()
+        return response.status_code, body
+
+    def location(self, path, data):
+        response = self.client.post(path, data=data)
+        return response.headers.get("Location", "")
+
+    def room_ids(self, project_id):
+        # Project pages need the deployed templates folder, so read the ids directly
+        import db
+        conn = db.connect()
+        try:
+            return [row[0] for row in conn.execute("""
+                SELECT r.room_id FROM rooms r JOIN floors f ON r.floor_id = f.floor_id
+                WHERE f.project_id = ? AND r.confirmed = 1 ORDER BY r.room_name
+            """, (project_id,))]
+        finally:
+            conn.close()
+
+
+class HttpClient:
+    """Drives a running server over HTTP with its own cookie session."""
+
+    def __init__(self, base_url, recorder):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.recorder = recorder
+
+    def post(self, path, json=None, data=None):
+        response = self.session.post(self.base_url + path, json=json, data=data, allow_redirects=False)
+        return response.status_code, response.content
+
+    def get(self, path):
+        response = self.session.get(self.base_url + path)
+        return response.status_code, response.content
+
+    def stream(self, path, json, label):
+        start = time.perf_counter()
+        body = b""
+        with self.session.post(self.base_url + path, json=json, stream=True) as response:
+            for chunk in response.iter_content(chunk_size=None):
+                if not body:
+                    self.recorder.record(f"{label} (first byte)", time.perf_counter() - start, response.status_code < 400)
+                body += chunk
+        return response.status_code, body
+
+    def location(self, path, data):
+        response = self.session.post(self.base_url + path, data=data, allow_redirects=False)
+        return response.headers.get("Location", "")
+
+    def room_ids(self, project_id):
+        status, body = self.get(f"/project/{project_id}")
+        return list(dict.fromkeys(re.findall(r'/room/([0-9a-f-]{36})/chat', body.decode("utf-8", "replace"))))
+
+
+def user_flow(client, recorder, args):
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    client.post("/register", data={"email": email, "password": "benchmark-password"})
+    location = client.location("/create-project", {"project_name": f"Benchmark House {email[6:12]}"})
+    project_id = location.rstrip("/").split("/")[-2]
+
+    for message in SETUP_MESSAGES:
+        if args.stream:
+            recorder.timed("setup-chat", lambda: client.stream(
+                f"/api/project/{project_id}/setup-chat/stream", {"message": message}, "setup-chat"))
+        else:
+            recorder.timed("setup-chat", lambda: client.post(
+                f"/api/project/{project_id}/setup-chat", json={"message": message}))
+    recorder.timed("confirm-rooms", lambda: client.post(
+        f"/api/project/{project_id}/confirm-rooms", json={"message": "yes"}))
+    recorder.timed("finalize", lambda: client.post(
+        f"/api/project/{project_id}/setup-chat", json={"action": "finalize"}))
+
+    rooms = client.room_ids(project_id)
+    if rooms:
+        for i in range(args.room_turns):
+            message = ROOM_MESSAGES[i % len(ROOM_MESSAGES)]
+            if args.stream:
+                recorder.timed("room-chat", lambda: client.stream(
+                    f"/api/chat/{rooms[0]}/stream", {"message": message}, "room-chat"))
+            else:
+                recorder.timed("room-chat", lambda: client.post(f"/api/chat/{rooms[0]}", json={"message": message}))
+
+    if args.report_mode != "none":
+        start = time.perf_counter()
+        status, body = recorder.timed("report enqueue", lambda: client.post(
+            f"/api/project/{project_id}/report?mode={args.report_mode}"))
+        job = json.loads(body)
+        deadline = time.monotonic() + args.report_timeout
+        while job.get("status") in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(args.poll_interval)
+            job = json.loads(client.get(job["status_url"])[1])
+        ok = job.get("status") == "done"
+        if ok:
+            status, _ = recorder.timed("report download", lambda: client.get(job["download_url"]))
+            ok = status == 200
+        recorder.record("report (end to end)", time.perf_counter() - start, ok)
+
+
+def summarize(recorder, elapsed):
+    results = {}
+    for label, samples in sorted(recorder.samples.items()):
+        latencies = sorted(seconds for seconds, _ in samples)
+        results[label] = {
+            "count": len(samples),
+            "errors": sum(1 for _, ok in samples if not ok),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1],
+            "throughput": len(samples) / elapsed if elapsed else 0.0,
+        }
+    return results
+
+
+def print_table(results, elapsed):
+    header = f"{'endpoint':<28}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>9}"
+    print(header)
+    print("-" * len(header))
+    for label, r in results.items():
+        print(f"{label:<28}{r['count']:>7}{r['errors']:>8}{r['p50'] * 1000:>10.1f}{r['p95'] * 1000:>10.1f}"
+              f"{r['p99'] * 1000:>10.1f}{r['max'] * 1000:>10.1f}{r['throughput']:>9.2f}")
+    print(f"\nwall time {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark")
+    parser.add_argument("--users", type=int, default=20, help="virtual users to run in total")
+    parser.add_argument("--concurrency", type=int, default=5, help="virtual users running at once")
+    parser.add_argument("--room-turns", type=int, default=4, help="room chat messages per user")
+    parser.add_argument("--stream", action="store_true", help="use the SSE chat endpoints and record time to first byte")
+    parser.add_argument("--report-mode", choices=["llm", "template", "none"], default="llm")
+    parser.add_argument("--report-timeout", type=float, default=120)
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--target", help="base URL of a running server; default runs the app in-process")
+    parser.add_argument("--json", help="write the results to this file")
+    mock_gemini.add_arguments(parser)
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    if args.target:
+        make_client = lambda: HttpClient(args.target, recorder)
+    else:
+        mock = mock_gemini.from_arguments(args)
+        _, base_url = mock_gemini.start(mock)
+        # Configure before the app modules read their environment
+        os.environ["GEMINI_BASE_URL"] = base_url
+        os.environ.setdefault("GEMINI_POOL_SIZE", str(max(16, args.concurrency * 2)))
+        os.environ.setdefault("HOUSING_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="housing-bench-"), "bench.db"))
+        os.environ.setdefault("SECRET_KEY", "benchmark")
+        from main import app
+        make_client = lambda: AppClient(app, recorder)
+
+    def run_user(_):
+        try:
+            user_flow(make_client(), recorder, args)
+        except Exception as e:
+            recorder.record("user flow", 0.0, False)
+            print(f"User flow failed: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run_user, range(args.users)))
+    elapsed = time.perf_counter() - start
+
+    results = summarize(recorder, elapsed)
+    print_table(results, elapsed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "wall_time": elapsed, "endpoints": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import os
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+from flask import g
+import metrics
+import slow_queries
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DB_PATH = os.getenv("HOUSING_DB_PATH", "housing_assistant.db")
+
+# Idle connections kept open for reuse; bursts beyond this open extra
+# connections that are closed again when they are returned.
+POOL_IDLE = int(os.getenv("HOUSING_DB_POOL_IDLE", 16))
+
+# Connection tuning applied once when a connection is opened
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA mmap_size = {int(os.getenv('HOUSING_DB_MMAP_SIZE', 268435456))}",
+    f"PRAGMA cache_size = {-int(os.getenv('HOUSING_DB_CACHE_KB', 16384))}",
+)
+
+_pool = queue.LifoQueue()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times every statement and counts the rows it touches or returns."""
+
+    _span = None
+    _sql = None
+
+    def _record(self, sql, parameters, start):
+        seconds = time.perf_counter() - start
+        self._sql = sql
+        if metrics.METRICS_ENABLED:
+            self._span = metrics.record_query(sql, seconds, self.rowcount)
+        if slow_queries.ENABLED:
+            slow_queries.record(self.connection, sql, parameters, seconds)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, parameters, start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(sql, None, start)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            metrics.record_rows(self._span, self._sql, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        metrics.record_rows(self._span, self._sql, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        metrics.record_rows(self._span, self._sql, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Connection.execute() creates its cursor internally, bypassing cursor()
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(path=None, instrumented=True):
+    # Pooled connections move between threads (or greenlets in the gevent
+    # server), but only one request uses a connection at a time. Schema setup
+    # passes instrumented=False so one-off DDL never becomes a metric series.
+    instrumented = instrumented and (metrics.METRICS_ENABLED or slow_queries.ENABLED)
+    factory = InstrumentedConnection if instrumented else sqlite3.Connection
+    conn = sqlite3.connect(path or DB_PATH, timeout=5.0, check_same_thread=False, factory=factory)
+    for pragma in PRAGMAS:
+        # Per-connection setup, not application queries
+        sqlite3.Connection.execute(conn, pragma)
+    return conn
+
+
+def acquire():
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return connect()
+
+
+def release(conn):
+    # Never carry an unfinished transaction over to the next borrower
+    if conn.in_transaction:
+        conn.rollback()
+    if _pool.qsize() < POOL_IDLE:
+        _pool.put(conn)
+    else:
+        conn.close()
+
+
+def get_db():
+    if "db" not in g:
+        g.db = acquire()
+    return g.db
+
+
+def detach_db():
+    # For responses that keep using the connection after the request is torn
+    # down; the caller takes over releasing it
+    return g.pop("db", None)
+
+
+def release_db(exception=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        release(conn)
+
+
+def close_pool():
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+
+@contextmanager
+def file_lock(path):
+    # Cross-process lock so only one worker runs schema setup at a time
+    with open(path, "a+") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
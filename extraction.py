@@ -0,0 +1,212 @@
+import contextvars
+import json
+import os
+import re
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass, field
+import db
+import extraction_cache
+import gemini
+import local_extractor
+
+# Answer short, structured messages with local rules instead of an LLM call
+LOCAL_EXTRACTION = os.getenv("LOCAL_EXTRACTION", "1") != "0"
+
+
+class ExtractionError(Exception):
+    pass
+
+
+@dataclass
+class Detail:
+    detail_type: str
+    detail_value: str
+
+
+@dataclass
+class RoomDetail:
+    room_name: str
+    detail_type: str
+    detail_value: str
+
+
+@dataclass
+class HouseExtraction:
+    house_details: list = field(default_factory=list)
+    rooms: list = field(default_factory=list)
+    room_details: list = field(default_factory=list)
+
+
+@dataclass
+class RoomListChange:
+    add: list = field(default_factory=list)
+    remove: list = field(default_factory=list)
+
+
+@dataclass
+class RoomExtraction:
+    details: list = field(default_factory=list)
+
+
+STRING = {"type": "STRING"}
+DETAIL_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"detail_type": STRING, "detail_value": STRING},
+    "required": ["detail_type", "detail_value"],
+}
+ROOM_DETAIL_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"room_name": STRING, "detail_type": STRING, "detail_value": STRING},
+    "required": ["room_name", "detail_type", "detail_value"],
+}
+
+SCHEMAS = {
+    "house": {
+        "type": "OBJECT",
+        "properties": {
+            "house_details": {"type": "ARRAY", "items": DETAIL_SCHEMA},
+            "rooms": {"type": "ARRAY", "items": STRING},
+            "room_details": {"type": "ARRAY", "items": ROOM_DETAIL_SCHEMA},
+        },
+        "required": ["house_details", "rooms", "room_details"],
+    },
+    "room_list": {
+        "type": "OBJECT",
+        "properties": {
+            "add": {"type": "ARRAY", "items": STRING},
+            "remove": {"type": "ARRAY", "items": STRING},
+        },
+        "required": ["add", "remove"],
+    },
+    "room": {
+        "type": "OBJECT",
+        "properties": {"details": {"type": "ARRAY", "items": DETAIL_SCHEMA}},
+        "required": ["details"],
+    },
+}
+
+
+def _text(value, name):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str) or not value.strip():
+        raise ExtractionError(f"{name} must be a non-empty string, got {value!r}")
+    return value.strip()
+
+
+def _list(data, key):
+    value = data.get(key, [])
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ExtractionError(f"{key} must be an array")
+    return value
+
+
+def _object(item, key):
+    if not isinstance(item, dict):
+        raise ExtractionError(f"{key} items must be objects")
+    return item
+
+
+def _details(data, key="details"):
+    return [
+        Detail(_text(_object(item, key).get("detail_type"), "detail_type"), _text(item.get("detail_value"), "detail_value"))
+        for item in _list(data, key)
+    ]
+
+
+def validate(kind, data):
+    if not isinstance(data, dict):
+        raise ExtractionError("extraction result must be a JSON object")
+    if kind == "house":
+        return HouseExtraction(
+            house_details=_details(data, "house_details"),
+            rooms=[_text(room, "room") for room in _list(data, "rooms")],
+            room_details=[
+                RoomDetail(
+                    _text(_object(item, "room_details").get("room_name"), "room_name"),
+                    _text(item.get("detail_type"), "detail_type"),
+                    _text(item.get("detail_value"), "detail_value"),
+                )
+                for item in _list(data, "room_details")
+            ],
+        )
+    if kind == "room_list":
+        return RoomListChange(
+            add=[_text(room, "room") for room in _list(data, "add")],
+            remove=[_text(room, "room") for room in _list(data, "remove")],
+        )
+    if kind == "room":
+        return RoomExtraction(details=_details(data))
+    raise ValueError(f"Unknown extraction kind: {kind}")
+
+
+def parse(text):
+    # responseMimeType should give bare JSON, but tolerate fenced output from older models
+    fenced = re.search(r'```(?:json)?\s*(.*?)\s*```', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ExtractionError(f"invalid JSON: {e}")
+
+
+def _payload(kind, prompt):
+    return {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": 0.1,
+            "maxOutputTokens": 1024,
+            "responseMimeType": "application/json",
+            "responseSchema": SCHEMAS[kind],
+        }
+    }
+
+
+def extract(kind, prompt):
+    text = gemini.generate(_payload(kind, prompt))
+    try:
+        return validate(kind, parse(text))
+    except ExtractionError as e:
+        # One corrective retry: show the model its output and the violation
+        retry_prompt = f"""{prompt}
+
+Your previous answer was rejected: {e}.
+Previous answer:
+{text}
+
+Return only JSON that matches the schema."""
+        return validate(kind, parse(gemini.generate(_payload(kind, retry_prompt))))
+
+
+def _completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _extract_and_remember(kind, prompt, key):
+    result = extract(kind, prompt)
+    # Runs on an executor thread while the request keeps using its own connection
+    conn = db.acquire()
+    try:
+        extraction_cache.put(conn, kind, key, asdict(result))
+    finally:
+        db.release(conn)
+    return result
+
+
+def submit(conn, kind, prompt, message=None):
+    if LOCAL_EXTRACTION and message:
+        result = local_extractor.extract(kind, message)
+        if result is not None:
+            return _completed(result)
+    if extraction_cache.ENABLED and message:
+        key = extraction_cache.cache_key(kind, prompt, message, SCHEMAS[kind])
+        data = extraction_cache.get(conn, kind, key)
+        if data is not None:
+            return _completed(validate(kind, data))
+        return gemini.executor.submit(contextvars.copy_context().run, _extract_and_remember, kind, prompt, key)
+    return gemini.executor.submit(contextvars.copy_context().run, extract, kind, prompt)
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import metrics
+from sqlite_cache import SQLiteCache
+
+# Extraction prompts are pure functions of the user message and their
+# template, so repeated inputs ("yes", "2 floors", a pasted room list) reuse
+# the earlier result. Hot keys are kept in memory in front of a SQLite table
+# that survives restarts.
+ENABLED = os.getenv("EXTRACTION_CACHE", "1") != "0"
+MEMORY_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MEMORY_ENTRIES", 1024))
+MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", 50000))
+TOUCH_INTERVAL = 3600
+# Bump when validation changes what a stored result turns into
+EXTRACTOR_VERSION = "1"
+
+log = logging.getLogger(__name__)
+
+requests_total = metrics.register(metrics.Counter(
+    "extraction_cache_requests_total", "Extraction result cache lookups", ["kind", "result"]))
+store = SQLiteCache("extraction_cache", "kind", "result", requests_total, MAX_ENTRIES, TOUCH_INTERVAL)
+
+
+def normalize(message):
+    message = unicodedata.normalize("NFKC", message).lower()
+    message = re.sub(r"\s+", " ", message).strip()
+    # "Yes!" and "yes" extract the same way
+    return message.rstrip(".!?, ")
+
+
+def cache_key(kind, prompt, message, schema):
+    # The prompt minus the message carries the context (room name) and the
+    # template wording, so editing a prompt starts a fresh set of entries
+    template = prompt.replace(message, "\x00")
+    serialized = json.dumps([EXTRACTOR_VERSION, kind, schema, template, normalize(message)],
+                            sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    def __init__(self, max_entries=MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+memory = MemoryCache()
+
+
+def get(conn, kind, key):
+    data = memory.get(key)
+    if data is not None:
+        requests_total.inc(1, kind, "memory_hit")
+        return data
+    try:
+        result = store.get(conn, kind, key)
+    except sqlite3.Error as e:
+        log.warning("Extraction Cache Error: %s", e)
+        return None
+    if result is None:
+        return None
+    data = json.loads(result)
+    memory.put(key, data)
+    return data
+
+
+def put(conn, kind, key, data):
+    memory.put(key, data)
+    try:
+        store.put(conn, kind, key, json.dumps(data, ensure_ascii=False))
+    except sqlite3.Error as e:
+        # The result is still returned to the caller; it just is not remembered
+        log.warning("Extraction Cache Error: %s", e)
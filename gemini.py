@@ -0,0 +1,214 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import requests
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "YOUR_GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_URL = f"{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
+GEMINI_STREAM_URL = f"{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}"
+
+CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", 30))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 2))
+BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", 8))
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", 30))
+POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", 16))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    pass
+
+
+class CircuitOpenError(GeminiError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # After the cooldown one trial call is let through (half-open)
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE))
+
+# Independent LLM calls within one chat turn are run side by side on this pool
+executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="gemini")
+
+
+def _backoff(attempt, retry_after=None):
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, delay)
+
+
+def _text_length(response_data):
+    try:
+        return sum(len(part.get("text", "")) for part in response_data['candidates'][0]['content']['parts'])
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return 0
+
+
+def post(payload, url=None):
+    start = time.perf_counter()
+    if not breaker.allow():
+        metrics.record_llm("generate", 0.0, "circuit_open", payload)
+        raise CircuitOpenError("Gemini circuit open")
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            response = _session.post(url or GEMINI_URL, json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            if response.status_code not in RETRY_STATUSES:
+                if response.status_code >= 400:
+                    # Client errors will not improve on retry, and say nothing about upstream health
+                    metrics.record_llm("generate", time.perf_counter() - start, "error", payload, retries=attempt)
+                    raise GeminiError(f"Gemini HTTP {response.status_code}: {response.text[:200]}")
+                breaker.record_success()
+                data = response.json()
+                metrics.record_llm("generate", time.perf_counter() - start, "ok", payload, _text_length(data),
+                                   data.get("usageMetadata"), attempt)
+                return data
+            retry_after = response.headers.get("Retry-After")
+            last_error = GeminiError(f"Gemini HTTP {response.status_code}")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            last_error = e
+        if attempt < MAX_RETRIES:
+            time.sleep(_backoff(attempt, retry_after))
+    breaker.record_failure()
+    metrics.record_llm("generate", time.perf_counter() - start, "error", payload, retries=MAX_RETRIES)
+    raise GeminiError(f"Gemini request failed after {MAX_RETRIES + 1} attempts: {last_error}")
+
+
+def _open_stream(payload):
+    """Returns (response, attempts beyond the first)."""
+    if not breaker.allow():
+        raise CircuitOpenError("Gemini circuit open")
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            response = _session.post(GEMINI_STREAM_URL, json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True)
+            if response.status_code not in RETRY_STATUSES:
+                if response.status_code >= 400:
+                    response.close()
+                    raise GeminiError(f"Gemini HTTP {response.status_code}")
+                return response, attempt
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            last_error = GeminiError(f"Gemini HTTP {response.status_code}")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            last_error = e
+        if attempt < MAX_RETRIES:
+            time.sleep(_backoff(attempt, retry_after))
+    breaker.record_failure()
+    raise GeminiError(f"Gemini stream failed after {MAX_RETRIES + 1} attempts: {last_error}")
+
+
+def stream(payload):
+    # Retries only happen before the first byte; once text has been yielded a
+    # failure is raised to the caller, which already holds the partial reply.
+    start = time.perf_counter()
+    try:
+        response, retries = _open_stream(payload)
+    except GeminiError as e:
+        outcome = "circuit_open" if isinstance(e, CircuitOpenError) else "error"
+        metrics.record_llm("stream", time.perf_counter() - start, outcome, payload, retries=MAX_RETRIES if outcome == "error" else 0)
+        raise
+    response.encoding = "utf-8"
+    outcome = "error"
+    received = 0
+    usage = None
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            chunk = json.loads(line[5:].strip())
+            # Token counts arrive with the final chunk
+            usage = chunk.get("usageMetadata", usage)
+            try:
+                text = chunk['candidates'][0]['content']['parts'][0]['text']
+            except (KeyError, IndexError, TypeError):
+                continue
+            if text:
+                received += len(text)
+                yield text
+        breaker.record_success()
+        outcome = "ok"
+    except GeneratorExit:
+        # The client went away mid-reply
+        outcome = "cancelled"
+        raise
+    except (requests.ConnectionError, requests.Timeout) as e:
+        breaker.record_failure()
+        raise GeminiError(f"Gemini stream interrupted: {e}")
+    finally:
+        response.close()
+        metrics.record_llm("stream", time.perf_counter() - start, outcome, payload, received, usage, retries)
+
+
+def response_text(response_data):
+    try:
+        return response_data['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError):
+        raise GeminiError(f"Unexpected Gemini response: {str(response_data)[:200]}")
+
+
+def generate(payload):
+    return response_text(post(payload))
+
+
+def submit(payload):
+    # Run in a copy of the caller's context so the call is traced to its request
+    return executor.submit(contextvars.copy_context().run, generate, payload)
+
+
+def wait(future):
+    try:
+        return future.result(timeout=(CONNECT_TIMEOUT + READ_TIMEOUT) * (MAX_RETRIES + 1) + BACKOFF_MAX * MAX_RETRIES)
+    except BaseException:
+        future.cancel()
+        raise
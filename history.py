@@ -0,0 +1,217 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+import db
+import gemini
+
+TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+ROOM_TOKEN_BUDGET = int(os.getenv("HISTORY_ROOM_TOKEN_BUDGET", 400))
+# Once this many turns have fallen out of the window they are folded into the summary
+COMPACT_THRESHOLD = int(os.getenv("HISTORY_COMPACT_THRESHOLD", 8))
+COMPACT_BATCH = int(os.getenv("HISTORY_COMPACT_BATCH", 40))
+# Messages per page for the chat pages and the history API
+PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 30))
+MAX_PAGE_SIZE = 100
+
+log = logging.getLogger(__name__)
+
+SOURCES = {
+    "project": ("setup_chat_history", "project_id"),
+    "room": ("chat_history", "room_id"),
+}
+
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+@dataclass
+class HistoryWindow:
+    scope: str
+    scope_id: str
+    summary: str = ""
+    messages: list = field(default_factory=list)
+    start: tuple = None
+    overflow: int = 0
+
+    def contents(self):
+        contents = []
+        if self.summary:
+            contents.append({"role": "assistant", "parts": [{"text": f"Summary of the earlier conversation: {self.summary}"}]})
+        for sender, message in self.messages:
+            role = "user" if sender == "user" else "assistant"
+            contents.append({"role": role, "parts": [{"text": message}]})
+        return contents
+
+    def transcript(self):
+        lines = [f"Earlier: {self.summary}"] if self.summary else []
+        lines.extend(f"{sender}: {message}" for sender, message in self.messages)
+        return "\n".join(lines)
+
+
+@dataclass
+class HistoryPage:
+    messages: list = field(default_factory=list)
+    before: str = None
+
+    def to_json(self):
+        return {
+            "messages": [
+                {"message_id": message_id, "sender": sender, "message": message, "timestamp": timestamp}
+                for message_id, sender, message, timestamp in self.messages
+            ],
+            "before": self.before,
+            "has_more": self.before is not None,
+        }
+
+
+def history_page(cursor, scope, scope_id, before=None, limit=PAGE_SIZE):
+    table, column = SOURCES[scope]
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # Keyset pagination: a page ends at the message the client last saw, so
+    # the cost of each page is independent of how far back it is
+    if before:
+        cursor.execute(f"""
+            SELECT m.message_id, m.sender, m.message, m.timestamp
+            FROM {table} m
+            JOIN (SELECT timestamp, rowid FROM {table} WHERE message_id = ? AND {column} = ?) b
+            WHERE m.{column} = ? AND (m.timestamp, m.rowid) < (b.timestamp, b.rowid)
+            ORDER BY m.timestamp DESC, m.rowid DESC
+            LIMIT ?
+        """, (before, scope_id, scope_id, limit + 1))
+    else:
+        cursor.execute(f"""
+            SELECT message_id, sender, message, timestamp
+            FROM {table}
+            WHERE {column} = ?
+            ORDER BY timestamp DESC, rowid DESC
+            LIMIT ?
+        """, (scope_id, limit + 1))
+    rows = cursor.fetchall()
+    page = HistoryPage(messages=rows[:limit][::-1])
+    if len(rows) > limit:
+        page.before = page.messages[0][0]
+    return page
+
+
+def load_summary(cursor, scope, scope_id):
+    cursor.execute("""
+        SELECT summary, covered_timestamp, covered_rowid
+        FROM chat_summaries
+        WHERE scope = ? AND scope_id = ?
+    """, (scope, scope_id))
+    row = cursor.fetchone()
+    if not row:
+        return "", ("", 0)
+    return row[0], (row[1], row[2])
+
+
+def history_window(cursor, scope, scope_id, budget=TOKEN_BUDGET):
+    table, column = SOURCES[scope]
+    summary, covered = load_summary(cursor, scope, scope_id)
+    window = HistoryWindow(scope, scope_id, summary=summary)
+    remaining = budget - (estimate_tokens(summary) if summary else 0)
+
+    # Newest first, stopping as soon as the budget is spent and enough
+    # overflow has been seen to decide whether compaction is due
+    cursor.execute(f"""
+        SELECT timestamp, rowid, sender, message
+        FROM {table}
+        WHERE {column} = ? AND (timestamp, rowid) > (?, ?)
+        ORDER BY timestamp DESC, rowid DESC
+    """, (scope_id, covered[0], covered[1]))
+    newest_first = []
+    while True:
+        rows = cursor.fetchmany(20)
+        if not rows:
+            break
+        for timestamp, rowid, sender, message in rows:
+            if window.overflow == 0:
+                cost = estimate_tokens(message)
+                if cost <= remaining or not newest_first:
+                    remaining -= cost
+                    newest_first.append((sender, message))
+                    window.start = (timestamp, rowid)
+                    continue
+            window.overflow += 1
+        if window.overflow >= COMPACT_THRESHOLD:
+            break
+    window.messages = newest_first[::-1]
+
+    if window.overflow >= COMPACT_THRESHOLD:
+        schedule_compaction(window)
+    return window
+
+
+def schedule_compaction(window):
+    key = (window.scope, window.scope_id)
+    with _compacting_lock:
+        if key in _compacting:
+            return
+        _compacting.add(key)
+    gemini.executor.submit(_compact, window.scope, window.scope_id, window.start)
+
+
+def _compact(scope, scope_id, window_start):
+    table, column = SOURCES[scope]
+    conn = db.acquire()
+    try:
+        cursor = conn.cursor()
+        summary, covered = load_summary(cursor, scope, scope_id)
+        cursor.execute(f"""
+            SELECT timestamp, rowid, sender, message
+            FROM {table}
+            WHERE {column} = ? AND (timestamp, rowid) > (?, ?) AND (timestamp, rowid) < (?, ?)
+            ORDER BY timestamp, rowid
+            LIMIT ?
+        """, (scope_id, covered[0], covered[1], window_start[0], window_start[1], COMPACT_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        transcript = "\n".join(f"{sender}: {message}" for _, _, sender, message in rows)
+        prompt = f"""Update the running summary of a house design conversation.
+
+Current summary:
+{summary or 'None'}
+
+New messages:
+{transcript}
+
+Return a concise summary (at most 120 words) that keeps every concrete detail, preference and decision the user gave. Return only the summary text."""
+        new_summary = gemini.generate({
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": 0.1, "maxOutputTokens": 256}
+        }).strip()
+        last_timestamp, last_rowid = rows[-1][0], rows[-1][1]
+        # Only move forward from the boundary we summarised from
+        cursor.execute("""
+            INSERT INTO chat_summaries (scope, scope_id, summary, covered_timestamp, covered_rowid)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (scope, scope_id) DO UPDATE SET
+                summary = excluded.summary,
+                covered_timestamp = excluded.covered_timestamp,
+                covered_rowid = excluded.covered_rowid,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE chat_summaries.covered_timestamp = ? AND chat_summaries.covered_rowid = ?
+        """, (scope, scope_id, new_summary, last_timestamp, last_rowid, covered[0], covered[1]))
+        conn.commit()
+    except Exception as e:
+        log.warning("History Compaction Error: %s", e)
+    finally:
+        db.release(conn)
+        with _compacting_lock:
+            _compacting.discard((scope, scope_id))
+
+
+def delete_summaries(cursor, project_id):
+    cursor.execute("""
+        DELETE FROM chat_summaries
+        WHERE (scope = 'project' AND scope_id = ?)
+           OR (scope = 'room' AND scope_id IN (
+                SELECT r.room_id FROM rooms r JOIN floors f ON r.floor_id = f.floor_id WHERE f.project_id = ?))
+    """, (project_id, project_id))
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import re
+import metrics
+from sqlite_cache import SQLiteCache
+
+# Opt-in cache for templated prompts whose replies hardly depend on the user,
+# such as the next room design question. Entries are shared between users, so
+# cacheable prompts are built from the cache key alone (see process_message).
+ENABLED = os.getenv("LLM_CACHE", "0") == "1"
+TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+TOUCH_INTERVAL = 300
+# Bump when a cached prompt changes so old replies are not served
+PROMPT_VERSION = "1"
+
+# Answers that colour the wording of later questions keep a few keywords;
+# any other answer only counts as given
+KEYWORD_DETAILS = {"style", "atmosphere", "color_scheme"}
+MAX_KEYWORDS = 3
+STOPWORDS = {
+    "a", "an", "and", "the", "with", "of", "for", "to", "in", "on", "some", "very", "really",
+    "i", "we", "want", "like", "would", "it", "is", "be", "something", "please", "more", "bit",
+    "look", "feel", "vibe", "style", "room",
+}
+
+requests_total = metrics.register(metrics.Counter(
+    "llm_cache_requests_total", "LLM response cache lookups", ["prompt_class", "result"]))
+store = SQLiteCache("llm_cache", "prompt_class", "response", requests_total,
+                    MAX_ENTRIES, TOUCH_INTERVAL, ttl=TTL)
+
+
+def room_label(room_name):
+    # "Bedroom 2" and "bedroom" ask the same questions
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z ]", " ", room_name.lower())).strip() or "room"
+
+
+def bucket_answers(answers):
+    buckets = {}
+    for detail_type, answer in sorted(answers.items()):
+        if detail_type in KEYWORD_DETAILS:
+            words = sorted({w for w in re.findall(r"[a-z]+", answer.lower()) if w not in STOPWORDS})
+            buckets[detail_type] = " ".join(words[:MAX_KEYWORDS]) or "given"
+        else:
+            buckets[detail_type] = "given"
+    return buckets
+
+
+def cache_key(prompt_class, **fields):
+    serialized = json.dumps({"version": PROMPT_VERSION, "class": prompt_class, **fields},
+                            sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def get(conn, prompt_class, key):
+    return store.get(conn, prompt_class, key)
+
+
+def put(conn, prompt_class, key, response):
+    store.put(conn, prompt_class, key, response)
@@ -0,0 +1,238 @@
+import re
+import extraction
+
+# Deterministic rules for short, structured answers. Each function returns a
+# result only when every part of the message was understood; otherwise None,
+# and the caller falls back to the LLM extractor.
+
+# Long messages are narrative and left to the LLM
+MAX_MESSAGE_LENGTH = 400
+
+HOUSE_DETAIL_TYPES = ['number_of_floors', 'architectural_style', 'house_type', 'size', 'plot_size', 'orientation']
+
+ROOM_NAMES = {
+    'master bedroom': 'Master Bedroom',
+    'guest bedroom': 'Guest Bedroom',
+    'guest room': 'Guest Room',
+    'bedroom': 'Bedroom',
+    'kitchen': 'Kitchen',
+    'living room': 'Living Room',
+    'dining room': 'Dining Room',
+    'bathroom': 'Bathroom',
+    'office': 'Office',
+    'study room': 'Study Room',
+    'study': 'Study Room',
+    'gym': 'Gym',
+    'laundry room': 'Laundry Room',
+    'laundry': 'Laundry Room',
+    'pooja room': 'Pooja Room',
+    'kids room': 'Kids Room',
+    'playroom': 'Playroom',
+    'home theater': 'Home Theater',
+}
+
+NUMBER_WORDS = {'one': 1, 'single': 1, 'two': 2, 'double': 2, 'three': 3, 'four': 4, 'five': 5}
+DIRECTION = r"(north|south|east|west)(?:[- ]?(east|west))?"
+ARCHITECTURAL_STYLES = ['contemporary modern', 'contemporary', 'modern', 'traditional', 'colonial', 'victorian',
+                        'minimalist', 'mediterranean', 'craftsman', 'farmhouse', 'industrial', 'scandinavian']
+HOUSE_TYPES = ['villa', 'bungalow', 'duplex', 'triplex', 'apartment', 'townhouse', 'cottage', 'penthouse']
+
+FLOORS = re.compile(r"^(?:(\d+)|(" + "|".join(NUMBER_WORDS) + r"))[ -]?(?:floors?|stor(?:e)?ys?|stories)$")
+AREA = re.compile(r"^(?:(plot|land)\s+(?:of\s+|size\s+)?)?(\d[\d,]*(?:\.\d+)?)\s*(sq\.?\s*ft|sqft|square\s+feet|sq\.?\s*m|sqm|square\s+met(?:er|re)s)(?:\s+(plot|house|home|built[- ]up))?$")
+ORIENTATION = re.compile(r"^(?:facing\s+" + DIRECTION + r"|" + DIRECTION + r"[- ]facing)$")
+BHK = re.compile(r"^(\d)\s*bhk$")
+
+AFFIRMATIONS = re.compile(r"^(yes|yep|yeah|sure|ok|okay|confirmed|confirm|looks good|sounds good|perfect|great|fine|no changes?)$")
+# Questions and hedged or negative answers ("no windows please", "skip budget",
+# "not sure about the colors yet") are not answers, so they go to the LLM
+QUESTION = re.compile(r"\?\s*$|^(what|which|how|why|when|where|who|should|could|would|can|do|does|is|are|any|suggest)\b")
+NEGATION = re.compile(r"\b(no|not|none|never|without|skip|unsure|undecided|later|maybe|tbd)\b|n't\b|\bdont\b")
+FILLER = re.compile(r"^(i want|i'd like|i would like|we want|let's have|lets have|i need|we need|please|a|an|the|my|our|it's|its|it is|house|home)\s+")
+
+# Keywords that map a free-form room detail onto the required_details vocabulary,
+# as (detail_type, nouns, modifiers). Modifiers only describe something else
+# ("white oak dining table", "light curtains"), so an item is only taken when it
+# matches exactly one category, and through a noun unless it is modifiers alone ("cozy")
+ROOM_DETAIL_KEYWORDS = [
+    ('dimensions', [r"\d+(\.\d+)?\s*(ft|feet|m)?\s*[x×]\s*\d+(\.\d+)?\s*(ft|feet|m)?", r"\d[\d,]*\s*(sq\.?\s*ft|sqft|sq\.?\s*m)"], []),
+    ('budget', [r"[$₹€£]\s?\d", r"\d+\s*(k|lakh|lakhs|dollars|rupees)\b", r"\bbudget\b"], []),
+    ('lighting', [r"\blight(s|ing)\b", r"\blamps?\b", r"\bpendant", r"\bchandelier", r"\bsconces?\b", r"\bdimmer"], [r"\blight\b"]),
+    ('flooring', [r"\bfloor", r"\btiles?\b", r"\bcarpet", r"\bhardwood\b", r"\blaminate\b", r"\bvinyl\b"], []),
+    ('windows', [r"\bwindows?\b", r"\bskylights?\b", r"\bcurtains?\b", r"\bblinds\b", r"\bdrapes\b"], []),
+    ('wall_treatments', [r"\bwall", r"\bwallpaper", r"\bpaint(ed)?\b", r"\bpanell?ing\b"], []),
+    ('storage', [r"\bshel(f|ves)", r"\bcabinets?\b", r"\bcloset", r"\bwardrobes?\b", r"\bdrawers?\b", r"\bstorage\b", r"\bpantry\b"], []),
+    ('technology', [r"\bsmart\b", r"\bspeakers?\b", r"\btv\b", r"\bwi-?fi\b", r"\bautomation\b", r"\bchargers?\b", r"\bprojector"], []),
+    ('accessibility', [r"\bwheelchair", r"\bgrab bars?\b", r"\bramps?\b", r"\bstep-free\b", r"\baccessib"], []),
+    ('sustainability', [r"\beco", r"\bsolar\b", r"\benergy[- ]efficient", r"\bsustainab"], [r"\brecycled\b", r"\bbamboo\b"]),
+    ('decor', [r"\bplants?\b", r"\bart(work)?\b", r"\brugs?\b", r"\bmirrors?\b", r"\bdecor", r"\bcushions?\b", r"\bvases?\b"], []),
+    ('textures', [r"\btextures?\b"], [r"\b(velvet|linen|leather|jute|boucle)\b"]),
+    ('color_scheme', [r"\bcolou?rs?\b", r"\bpalette\b", r"\btones\b"],
+     [r"\b(white|beige|grey|gray|blue|green|navy|black|cream|pastel|earthy|neutral|teal|terracotta)\b"]),
+    ('style', [r"\bstyle\b"],
+     [r"\b(modern|minimalist|scandinavian|industrial|rustic|bohemian|boho|traditional|contemporary|mid-century|coastal)\b"]),
+    ('atmosphere', [r"\b(vibe|feel|mood)\b"],
+     [r"\b(cozy|cosy|calm|airy|bright|vibrant|serene|relaxing|warm|peaceful|energetic|luxurious)\b"]),
+    ('activities', [r"\b(reading|cooking|working|sleeping|gaming|yoga|studying|entertaining|baking|workouts?)\b"], []),
+    ('furniture', [r"\bbeds?\b", r"\bsofas?\b", r"\bcouch", r"\btables?\b", r"\bchairs?\b", r"\bdesks?\b", r"\bsinks?\b",
+                   r"\bislands?\b", r"\bcounter(top)?s?\b", r"\bstools?\b", r"\bdressers?\b", r"\bbench", r"\bottomans?\b"], []),
+]
+ROOM_DETAIL_PATTERNS = [(detail_type,
+                         re.compile("|".join(nouns), re.IGNORECASE),
+                         re.compile("|".join(modifiers), re.IGNORECASE) if modifiers else None)
+                        for detail_type, nouns, modifiers in ROOM_DETAIL_KEYWORDS]
+
+
+def normalize(message):
+    return re.sub(r"\s+", " ", message.strip().lower()).strip(" .!")
+
+
+def is_tentative(text):
+    text = normalize(text.replace("’", "'"))
+    return bool(QUESTION.search(text) or NEGATION.search(text))
+
+
+def split_items(text):
+    parts = re.split(r"\s*(?:,|;|\n|\band\b|\bwith\b|&|\+)\s*", text)
+    return [part.strip(" .!") for part in parts if part.strip(" .!")]
+
+
+def strip_filler(item):
+    previous = None
+    while previous != item:
+        previous = item
+        item = FILLER.sub("", item)
+    return item
+
+
+def _room_name(item):
+    # Several rooms of one kind need distinct names, which is left to the LLM
+    item = re.sub(r"^(1|a|an|one)\s+", "", item)
+    return ROOM_NAMES.get(item)
+
+
+def extract_house(message):
+    text = normalize(message)
+    if not text:
+        return None
+    if AFFIRMATIONS.match(text):
+        return extraction.HouseExtraction()
+    if is_tentative(text):
+        return None
+    result = extraction.HouseExtraction()
+    for item in split_items(text):
+        item = strip_filler(item)
+        if not item:
+            continue
+        match = FLOORS.match(item)
+        if match:
+            result.house_details.append(extraction.Detail('number_of_floors', str(match.group(1) or NUMBER_WORDS[match.group(2)])))
+            continue
+        match = AREA.match(item)
+        if match:
+            detail_type = 'plot_size' if match.group(1) or match.group(4) == 'plot' else 'size'
+            unit = re.sub(r"\s+", " ", match.group(3))
+            result.house_details.append(extraction.Detail(detail_type, f"{match.group(2)} {unit}"))
+            continue
+        match = ORIENTATION.match(item)
+        if match:
+            direction = "-".join(d for d in match.groups() if d)
+            result.house_details.append(extraction.Detail('orientation', f"{direction} facing"))
+            continue
+        match = BHK.match(item)
+        if match:
+            result.house_details.append(extraction.Detail('house_type', f"{match.group(1)}BHK"))
+            continue
+        if item in ARCHITECTURAL_STYLES:
+            result.house_details.append(extraction.Detail('architectural_style', item))
+            continue
+        if item in HOUSE_TYPES:
+            result.house_details.append(extraction.Detail('house_type', item))
+            continue
+        room = _room_name(item)
+        if room:
+            if room not in result.rooms:
+                result.rooms.append(room)
+            continue
+        return None
+    return result
+
+
+def _room_detail_type(item):
+    matches = {}
+    for detail_type, nouns, modifiers in ROOM_DETAIL_PATTERNS:
+        if nouns.search(item):
+            matches[detail_type] = None
+        elif modifiers and modifiers.search(item):
+            matches[detail_type] = modifiers
+    # "floor-to-ceiling windows", "black leather sofa": more than one reading
+    if len(matches) != 1:
+        return None
+    detail_type, modifiers = matches.popitem()
+    # "white oak" describes something that was not recognised
+    if modifiers and re.search(r"\w", modifiers.sub("", item)):
+        return None
+    return detail_type
+
+
+def extract_room(message):
+    text = message.strip()
+    if not text:
+        return None
+    if AFFIRMATIONS.match(normalize(text)):
+        return extraction.RoomExtraction()
+    if is_tentative(text):
+        return None
+    # Structured input such as "Kitchen: marble sink, ample shelves"
+    label = re.match(r"^\s*([A-Za-z][A-Za-z ]{0,30}):\s*(.+)$", text, re.DOTALL)
+    if label:
+        text = label.group(2)
+    values = {}
+    for item in split_items(text):
+        # "one floor" is a floor count, not a flooring choice
+        if FLOORS.match(strip_filler(normalize(item))):
+            return None
+        detail_type = _room_detail_type(item)
+        if not detail_type:
+            return None
+        values.setdefault(detail_type, []).append(item)
+    if not values:
+        return None
+    return extraction.RoomExtraction(details=[extraction.Detail(detail_type, ", ".join(items)) for detail_type, items in values.items()])
+
+
+def extract_room_list(message):
+    text = normalize(message)
+    if not text:
+        return None
+    if AFFIRMATIONS.match(text) or re.match(r"^yes\b", text):
+        # Confirmation handling is separate; a plain "yes" changes nothing
+        remainder = re.sub(r"^yes\b[ ,!.]*", "", text)
+        if not remainder or AFFIRMATIONS.match(remainder):
+            return extraction.RoomListChange()
+    if is_tentative(text):
+        return None
+    match = re.match(r"^(add|remove|delete|drop)\s+(?:the\s+)?(.+)$", text)
+    if not match:
+        return None
+    rooms = []
+    for item in split_items(match.group(2)):
+        room = _room_name(item)
+        if not room:
+            return None
+        rooms.append(room)
+    if match.group(1) == 'add':
+        return extraction.RoomListChange(add=rooms)
+    return extraction.RoomListChange(remove=rooms)
+
+
+EXTRACTORS = {
+    "house": extract_house,
+    "room_list": extract_room_list,
+    "room": extract_room,
+}
+
+
+def extract(kind, message):
+    if not message or len(message) > MAX_MESSAGE_LENGTH:
+        return None
+    return EXTRACTORS[kind](message)
@@ -1,32 +1,47 @@
 from dotenv import load_dotenv
 load_dotenv()
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file, Response, stream_with_context
 import os
 import json
-import sqlite3
-import requests
 import uuid
 import io
 import hashlib
 import re
-from datetime import datetime
-from fpdf import FPDF
-from flask_session import Session
+import secrets
+import click
+import logging
 from functools import wraps
-import tempfile
+import db
+import metrics
+import migrations
+import sessions
+import slow_queries
+import gemini
+import extraction
+import llm_cache
+import local_extractor
+import room_state
+import report_jobs
+import reports
+from report_cache import report_cache
+from snapshot import load_snapshot
+from history import history_window, history_page, delete_summaries, ROOM_TOKEN_BUDGET, PAGE_SIZE
+from db import get_db
 
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+log = logging.getLogger(__name__)
 
-# Gemini API Configuration
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "YOUR_GEMINI_API_KEY")
-GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}"
+# Routes are collected here and attached to every app built by create_app()
+routes = []
+
+def route(rule, **options):
+    def decorator(f):
+        routes.append((rule, options, f))
+        return f
+    return decorator
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = db.connect(instrumented=False)
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -137,9 +152,87 @@ def init_db():
     ''')
     
     conn.commit()
+    migrations.migrate(conn)
     conn.close()
 
-init_db()
+def ensure_schema():
+    conn = db.connect(instrumented=False)
+    try:
+        if migrations.is_current(conn):
+            return
+    finally:
+        conn.close()
+    with db.file_lock(db.DB_PATH + ".lock"):
+        init_db()
+
+@click.command('init-db')
+def init_db_command():
+    with db.file_lock(db.DB_PATH + ".lock"):
+        init_db()
+    click.echo(f"Database schema is at version {migrations.LATEST_VERSION}.")
+
+@click.command('slow-queries')
+@click.option('--limit', default=20, show_default=True, help='Number of statements to show.')
+@click.option('--sort', type=click.Choice(sorted(slow_queries.SORT_COLUMNS)), default='total', show_default=True)
+@click.option('--reset', is_flag=True, help='Clear the log instead of showing it.')
+def slow_queries_command(limit, sort, reset):
+    """Show the statements recorded with HOUSING_SLOW_QUERY_MS set."""
+    if reset:
+        slow_queries.reset()
+        click.echo("Slow query log cleared.")
+        return
+    rows = slow_queries.top(limit, sort)
+    if not rows:
+        click.echo(f"No slow queries recorded in {slow_queries.LOG_PATH}.")
+        return
+    for statement, plan, full_scan, calls, total_seconds, max_seconds in rows:
+        click.echo(f"{total_seconds * 1000:10.1f} ms total  {calls:6d} calls  "
+                   f"{total_seconds / calls * 1000:8.2f} ms avg  {max_seconds * 1000:8.2f} ms max"
+                   + ("  FULL SCAN" if full_scan else ""))
+        click.echo(f"    {statement}")
+        for line in plan.splitlines():
+            click.echo(f"      {line}")
+        click.echo("")
+
+def load_secret_key():
+    secret = os.getenv("SECRET_KEY")
+    if secret:
+        return secret
+    # Without an explicit secret, all workers share one generated key on disk
+    path = os.getenv("SECRET_KEY_FILE", os.path.join("instance", "secret_key"))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_path)
+    with open(path) as f:
+        return f.read().strip()
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.from_mapping(
+        SECRET_KEY=load_secret_key(),
+        AUTO_MIGRATE=os.getenv("HOUSING_AUTO_MIGRATE", "1") == "1",
+    )
+    if config:
+        app.config.update(config)
+    sessions.init_app(app)
+    db.init_app(app)
+    metrics.init_app(app)
+    for rule, options, view_func in routes:
+        app.add_url_rule(rule, view_func=view_func, **options)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(slow_queries_command)
+    # Production deployments can run `flask --app main init-db` once and set HOUSING_AUTO_MIGRATE=0
+    if app.config["AUTO_MIGRATE"]:
+        ensure_schema()
+    return app
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -152,7 +245,192 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/register', methods=['GET', 'POST'])
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(payload, fallback_message, on_complete, on_success=None):
+    def generate():
+        chunks = []
+        completed = False
+        try:
+            try:
+                for chunk in gemini.stream(payload):
+                    chunks.append(chunk)
+                    yield sse_event("token", {"text": chunk})
+                completed = True
+            except Exception as e:
+                log.warning("Gemini Stream Error: %s", e)
+                if not chunks:
+                    chunks.append(fallback_message)
+                    yield sse_event("token", {"text": fallback_message})
+        finally:
+            # Also runs when the client disconnects mid-stream (GeneratorExit),
+            # so the turn's extraction and reply are still saved
+            assistant_message = "".join(chunks) or fallback_message
+            on_complete(assistant_message, completed)
+        # Only complete replies are worth keeping, not fallbacks or cut-off streams
+        if on_success and completed:
+            on_success(assistant_message)
+        yield sse_event("done", {"message": assistant_message})
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Flask releases the request's connection before the body runs, so the
+    # stream takes it over and returns it to the pool once the response closes
+    conn = db.detach_db()
+    if conn is not None:
+        response.call_on_close(lambda: db.release(conn))
+    return response
+
+def message_stream(assistant_message):
+    return Response(
+        sse_event("token", {"text": assistant_message}) + sse_event("done", {"message": assistant_message}),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache"}
+    )
+
+def save_setup_message(cursor, project_id, assistant_message):
+    message_id = str(uuid.uuid4())
+    cursor.execute(
+        "INSERT INTO setup_chat_history (message_id, project_id, sender, message) VALUES (?, ?, ?, ?)",
+        (message_id, project_id, "assistant", assistant_message)
+    )
+
+def project_floor(cursor, project_id):
+    floor = cursor.execute(
+        "SELECT floor_id FROM floors WHERE project_id = ? ORDER BY floor_number LIMIT 1", (project_id,)
+    ).fetchone()
+    if floor:
+        return floor[0]
+    floor_id = str(uuid.uuid4())
+    cursor.execute(
+        "INSERT INTO floors (floor_id, project_id, floor_number) VALUES (?, ?, ?)",
+        (floor_id, project_id, 1)
+    )
+    return floor_id
+
+def seed_room_greetings(cursor, project_id):
+    # Opens each room tab with its first question, once; message ids are
+    # generated in SQL in the same format as uuid.uuid4()
+    cursor.execute("""
+        INSERT INTO chat_history (message_id, room_id, sender, message)
+        SELECT lower(hex(randomblob(4))) || '-' || lower(hex(randomblob(2))) || '-4' ||
+               substr(lower(hex(randomblob(2))), 2) || '-' || substr('89ab', 1 + (abs(random()) % 4), 1) ||
+               substr(lower(hex(randomblob(2))), 2) || '-' || lower(hex(randomblob(6))),
+               r.room_id, 'assistant', 'What''s the overall vibe you''re going for in your ' || r.room_name || '?'
+        FROM rooms r
+        JOIN floors f ON r.floor_id = f.floor_id
+        WHERE f.project_id = ? AND r.confirmed = 1
+          AND NOT EXISTS (SELECT 1 FROM chat_history h WHERE h.room_id = r.room_id AND h.sender = 'assistant')
+    """, (project_id,))
+
+def merge_room(cursor, keep_id, duplicate_id):
+    # Same folding as migration 5: the duplicate's chat, details and answers
+    # move to the kept room, values of one type are joined, then it is deleted
+    cursor.execute("UPDATE chat_history SET room_id = ? WHERE room_id = ?", (keep_id, duplicate_id))
+    cursor.execute("""
+        INSERT INTO room_details (detail_id, room_id, detail_type, detail_value)
+        SELECT lower(hex(randomblob(16))), ?, detail_type, detail_value FROM room_details WHERE room_id = ?
+        ON CONFLICT (room_id, detail_type) DO UPDATE
+            SET detail_value = room_details.detail_value || ', ' || excluded.detail_value
+            WHERE instr(room_details.detail_value, excluded.detail_value) = 0
+    """, (keep_id, duplicate_id))
+    cursor.execute("""
+        INSERT INTO room_design_questions (question_id, room_id, question_type, answer, is_complete)
+        SELECT lower(hex(randomblob(16))), ?, question_type, answer, is_complete FROM room_design_questions WHERE room_id = ?
+        ON CONFLICT (room_id, question_type) DO UPDATE SET
+            answer = CASE
+                WHEN room_design_questions.answer IS NULL THEN excluded.answer
+                WHEN excluded.answer IS NULL OR instr(room_design_questions.answer, excluded.answer) > 0 THEN room_design_questions.answer
+                ELSE room_design_questions.answer || ', ' || excluded.answer
+            END,
+            is_complete = MAX(room_design_questions.is_complete, excluded.is_complete)
+    """, (keep_id, duplicate_id))
+    cursor.execute("""
+        UPDATE room_design_state SET room_id = ?
+        WHERE room_id = ? AND NOT EXISTS (SELECT 1 FROM room_design_state WHERE room_id = ?)
+    """, (keep_id, duplicate_id, keep_id))
+    cursor.execute("DELETE FROM chat_summaries WHERE scope = 'room' AND scope_id IN (?, ?)", (keep_id, duplicate_id))
+    cursor.execute("DELETE FROM rooms WHERE room_id = ?", (duplicate_id,))
+
+def finalize_rooms(cursor, project_id):
+    # Safe to repeat: the project keeps its first floor, every room ends up
+    # confirmed on it, and rooms that already have a greeting get no second one
+    floor_id = project_floor(cursor, project_id)
+    # Confirming first takes the write lock, so no room can appear between the
+    # merge and the move below
+    cursor.execute("""
+        UPDATE rooms SET confirmed = 1
+        WHERE confirmed = 0 AND floor_id IN (SELECT floor_id FROM floors WHERE project_id = ?)
+    """, (project_id,))
+    # Rooms sharing a name would collide on the kept floor; fold each into the
+    # one already there, or else the one on the lowest floor
+    cursor.execute("""
+        SELECT r.room_id, r.room_name
+        FROM rooms r JOIN floors f ON r.floor_id = f.floor_id
+        WHERE f.project_id = ?
+        ORDER BY r.floor_id = ? DESC, f.floor_number, r.rowid
+    """, (project_id, floor_id))
+    kept = {}
+    for room_id, room_name in cursor.fetchall():
+        if room_name in kept:
+            merge_room(cursor, kept[room_name], room_id)
+        else:
+            kept[room_name] = room_id
+    # After the merge every name is unique in the project; the guards keep the
+    # set-based move clear of uq_rooms_floor_name regardless
+    cursor.execute("""
+        UPDATE rooms SET floor_id = ?
+        WHERE floor_id IN (SELECT floor_id FROM floors WHERE project_id = ? AND floor_id != ?)
+          AND room_name NOT IN (SELECT room_name FROM rooms WHERE floor_id = ?)
+          AND rowid = (
+              SELECT MIN(r.rowid) FROM rooms r JOIN floors f ON r.floor_id = f.floor_id
+              WHERE f.project_id = ? AND r.room_name = rooms.room_name
+          )
+    """, (floor_id, project_id, floor_id, floor_id, project_id))
+    cursor.execute("DELETE FROM floors WHERE project_id = ? AND floor_id != ?", (project_id, floor_id))
+    seed_room_greetings(cursor, project_id)
+
+# Extracted values are written as batched upserts against the UNIQUE natural
+# keys, so repeating a detail updates it instead of adding another row.
+
+def upsert_house_details(cursor, project_id, details):
+    cursor.executemany("""
+        INSERT INTO house_details (detail_id, project_id, detail_type, detail_value) VALUES (?, ?, ?, ?)
+        ON CONFLICT (project_id, detail_type) DO UPDATE SET detail_value = excluded.detail_value
+    """, [(str(uuid.uuid4()), project_id, detail.detail_type, detail.detail_value) for detail in details])
+
+def insert_rooms(cursor, floor_id, room_names, confirmed=0):
+    cursor.executemany("""
+        INSERT INTO rooms (room_id, floor_id, room_name, confirmed) VALUES (?, ?, ?, ?)
+        ON CONFLICT (floor_id, room_name) DO NOTHING
+    """, [(str(uuid.uuid4()), floor_id, room_name, confirmed) for room_name in room_names])
+
+def join_detail_values(details, key):
+    # One row per detail type, so several values from one message are kept together
+    grouped = {}
+    for detail in details:
+        grouped.setdefault(key(detail), []).append(detail.detail_value)
+    return [(group, ", ".join(dict.fromkeys(values))) for group, values in grouped.items()]
+
+def upsert_room_details(cursor, project_id, room_details):
+    # Details for rooms that do not exist in the project are dropped by the join
+    cursor.executemany("""
+        INSERT INTO room_details (detail_id, room_id, detail_type, detail_value)
+        SELECT ?, r.room_id, ?, ?
+        FROM rooms r JOIN floors f ON r.floor_id = f.floor_id
+        WHERE f.project_id = ? AND r.room_name = ?
+        ON CONFLICT (room_id, detail_type) DO UPDATE SET detail_value = excluded.detail_value
+    """, [
+        (str(uuid.uuid4()), detail_type, detail_value, project_id, room_name)
+        for (room_name, detail_type), detail_value
+        in join_detail_values(room_details, lambda detail: (detail.room_name, detail.detail_type))
+    ])
+
+@route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         email = request.form['email']
@@ -164,13 +442,12 @@ def register():
         if len(password) < 8:
             return render_template('register.html', error="Password must be at least 8 characters")
         
-        conn = sqlite3.connect('housing_assistant.db')
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
         existing_user = cursor.fetchone()
         
         if existing_user:
-            conn.close()
             return render_template('register.html', error="Email already registered")
         
         user_id = str(uuid.uuid4())
@@ -181,7 +458,6 @@ def register():
             (user_id, email, hashed_password)
         )
         conn.commit()
-        conn.close()
         
         session['user_id'] = user_id
         session['email'] = email
@@ -189,21 +465,20 @@ def register():
         
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
         hashed_password = hash_password(password)
         
-        conn = sqlite3.connect('housing_assistant.db')
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute(
             "SELECT user_id, email FROM users WHERE email = ? AND password = ?",
             (email, hashed_password)
         )
         user = cursor.fetchone()
-        conn.close()
         
         if user:
             session['user_id'] = user[0]
@@ -214,38 +489,37 @@ def login():
     
     return render_template('login.html')
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     session.clear()
     return redirect(url_for('login'))
 
-@app.route('/')
+@route('/')
 def index():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
     return redirect(url_for('login'))
 
-@app.route('/dashboard')
+@route('/dashboard')
 @login_required
 def dashboard():
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT project_id, project_name, created_at FROM projects WHERE user_id = ? ORDER BY created_at DESC",
         (session['user_id'],)
     )
     projects = cursor.fetchall()
-    conn.close()
     
     return render_template('dashboard.html', projects=projects)
 
-@app.route('/create-project', methods=['POST'])
+@route('/create-project', methods=['POST'])
 @login_required
 def create_project():
     project_name = request.form['project_name']
     project_id = str(uuid.uuid4())
     
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
         "INSERT INTO projects (project_id, user_id, project_name) VALUES (?, ?, ?)",
@@ -258,90 +532,47 @@ def create_project():
         (message_id, project_id, "assistant", welcome_message)
     )
     conn.commit()
-    conn.close()
     
     return redirect(url_for('project_setup', project_id=project_id))
 
-@app.route('/project/<project_id>/setup', methods=['GET'])
+@route('/project/<project_id>/setup', methods=['GET'])
 @login_required
 def project_setup(project_id):
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute(
-        "SELECT project_id, project_name FROM projects WHERE project_id = ? AND user_id = ?",
-        (project_id, session['user_id'])
-    )
-    project = cursor.fetchone()
+    snapshot = load_snapshot(cursor, project_id, session['user_id'], with_room_details=False)
     
-    if not project:
-        conn.close()
+    if not snapshot:
         return redirect(url_for('dashboard'))
     
-    cursor.execute("""
-        SELECT message_id, sender, message, timestamp
-        FROM setup_chat_history
-        WHERE project_id = ?
-        ORDER BY timestamp
-    """, (project_id,))
-    
-    chat_history = cursor.fetchall()
-    
-    cursor.execute("""
-        SELECT detail_type, detail_value
-        FROM house_details
-        WHERE project_id = ?
-    """, (project_id,))
-    
-    house_details = cursor.fetchall()
-    
-    cursor.execute("""
-        SELECT area_type, description
-        FROM outer_areas
-        WHERE project_id = ?
-    """, (project_id,))
-    
-    outer_areas = cursor.fetchall()
-    
-    cursor.execute("""
-        SELECT room_name
-        FROM rooms
-        WHERE floor_id IN (SELECT floor_id FROM floors WHERE project_id = ?)
-    """, (project_id,))
-    
-    rooms = [row[0] for row in cursor.fetchall()]
-    
-    conn.close()
+    history = history_page(cursor, "project", project_id)
     
     return render_template('project_setup_chat.html',
                           project_id=project_id,
-                          project_name=project[1],
-                          chat_history=chat_history,
-                          house_details=house_details,
-                          outer_areas=outer_areas,
-                          rooms=rooms)
+                          project_name=snapshot.project_name,
+                          chat_history=history.messages,
+                          history_before=history.before,
+                          house_details=snapshot.house_detail_rows,
+                          outer_areas=snapshot.outer_area_rows,
+                          rooms=snapshot.room_names)
 
-@app.route('/api/project/<project_id>/setup-chat', methods=['POST'])
+@route('/api/project/<project_id>/setup-chat', methods=['POST'])
+@route('/api/project/<project_id>/setup-chat/stream', methods=['POST'], defaults={'stream': True})
 @login_required
-def project_setup_chat(project_id):
+def project_setup_chat(project_id, stream=False):
     user_message = request.json.get('message')
     action = request.json.get('action', None)
     
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT project_name
-        FROM projects
-        WHERE project_id = ? AND user_id = ?
-    """, (project_id, session['user_id']))
+    # Room details are only needed for the finalize summary
+    snapshot = load_snapshot(cursor, project_id, session['user_id'], with_room_details=(action == "finalize"))
     
-    project = cursor.fetchone()
-    
-    if not project:
-        conn.close()
+    if not snapshot:
         return jsonify({"error": "Unauthorized"}), 403
     
-    project_name = project[0]
+    project_name = snapshot.project_name
     
     if user_message:
         message_id = str(uuid.uuid4())
@@ -351,37 +582,11 @@ def project_setup_chat(project_id):
         )
         conn.commit()
     
-    cursor.execute("""
-        SELECT sender, message
-        FROM setup_chat_history
-        WHERE project_id = ?
-        ORDER BY timestamp
-        LIMIT 20
-    """, (project_id,))
-    
-    chat_history = cursor.fetchall()
-    
-    cursor.execute("""
-        SELECT detail_type, detail_value
-        FROM house_details
-        WHERE project_id = ?
-    """, (project_id,))
+    # Newest turns within the token budget (including the message just stored), older ones summarised
+    formatted_history = history_window(cursor, "project", project_id).contents()
     
-    house_details = {row[0]: row[1] for row in cursor.fetchall()}
-    
-    cursor.execute("""
-        SELECT room_id, room_name
-        FROM rooms
-        WHERE floor_id IN (SELECT floor_id FROM floors WHERE project_id = ?)
-    """, (project_id,))
-    
-    rooms = cursor.fetchall()
-    room_names = [room[1] for room in rooms]
-    
-    formatted_history = []
-    for sender, message in chat_history:
-        role = "user" if sender == "user" else "assistant"
-        formatted_history.append({"role": role, "parts": [{"text": message}]})
+    house_details = snapshot.house_details
+    room_names = snapshot.room_names
     
     system_instruction = f"""You’re a house design assistant for project '{project_name}'. Your goal is to set up the house by asking ONE question at a time about:
 1. Number of floors
@@ -411,107 +616,23 @@ Rooms: {', '.join(room_names) or 'None'}.
     if action == "outer_area":
         assistant_message = "What outdoor features would you like, such as a garden, parking, or balconies?"
     elif action == "finalize":
-        # Collect room details
-        room_details_summary = {}
-        for room_id, room_name in rooms:
-            cursor.execute("""
-                SELECT detail_type, detail_value
-                FROM room_details
-                WHERE room_id = ?
-            """, (room_id,))
-            room_details = {row[0]: row[1] for row in cursor.fetchall()}
-            room_details_summary[room_name] = room_details
-        
-        cursor.execute("""
-            SELECT area_type, description
-            FROM outer_areas
-            WHERE project_id = ?
-        """, (project_id,))
-        outer_areas = {row[0]: row[1] for row in cursor.fetchall()}
-        
-        summary_prompt = f"""Generate a structured summary for project '{project_name}' based on user-provided details only:
-
-House Details:
-{json.dumps(house_details, indent=2)}
-
-Rooms and Their Details:
-{json.dumps({name: details for name, details in room_details_summary.items()}, indent=2)}
-
-Outdoor Areas:
-{json.dumps(outer_areas, indent=2)}
-
-Instructions:
-- Structure the summary with sections like the reference report:
-  - 1. General Information: House type, number of stories.
-  - 2. Rooms & Spaces: Number of bedrooms, bathrooms, additional rooms (e.g., office, gym).
-  - 3. Bedroom Specifications: Details for Master Bedroom, other bedrooms (e.g., closets, windows, bathrooms).
-  - 4. Office Specifications: Size, features (e.g., desk space, lighting).
-  - 5. Gym Specifications: Size, features (e.g., cardio equipment, ventilation).
-  - 6. Living & Dining Area: Layout, special features.
-  - 7. Kitchen Preferences: Layout, lighting, storage.
-  - Overall Summary: A concise, friendly recap with emojis (e.g., 'This multi-story home with a gym and office is going to be amazing! 🏡😍').
-- Include only details explicitly provided by the user (e.g., if style is given, include it; if not, omit it).
-- Do not mention unspecified, missing, or default details.
-- Use bullet points for each section.
-- Example:
-  '1. General Information
-  - House Type: Multi-story
-  - Number of Stories: 2
-  2. Rooms & Spaces
-  - Bedrooms: 3 (Spacious)
-  - Bathrooms: 4
-  - Additional Rooms: Office, Gym
-  3. Bedroom Specifications
-  - Master Bedroom: Spacious with a custom wall texture
-  - Other Bedrooms: Slightly smaller than master, with closets
-  Overall Summary: This multi-story home with a gym and office is going to be amazing! 🏡😍'
-
-Return only the structured summary text."""
+        # The room layout is committed first in one short transaction; the
+        # summary call below runs without holding the write lock
+        finalize_rooms(cursor, project_id)
+        conn.commit()
         
+        summary_prompt = reports.summary_prompt(project_name, house_details, snapshot.room_details_summary(), snapshot.outer_areas)
         payload = {
             "contents": [{"role": "user", "parts": [{"text": summary_prompt}]}],
             "generationConfig": {"temperature": 0.2, "maxOutputTokens": 1024}
         }
         
         try:
-            response = requests.post(GEMINI_URL, json=payload)
-            response_data = response.json()
-            assistant_message = response_data['candidates'][0]['content']['parts'][0]['text']
-            
-            # Finalize rooms and set up tabs
-            cursor.execute("DELETE FROM floors WHERE project_id = ?", (project_id,))
-            floor_id = str(uuid.uuid4())
-            cursor.execute(
-                "INSERT INTO floors (floor_id, project_id, floor_number) VALUES (?, ?, ?)",
-                (floor_id, project_id, 1)
-            )
-            
-            for room_id, room_name in rooms:
-                cursor.execute(
-                    "UPDATE rooms SET floor_id = ?, confirmed = 1 WHERE room_id = ?",
-                    (floor_id, room_id)
-                )
-                cursor.execute("""
-                    SELECT message_id
-                    FROM chat_history
-                    WHERE room_id = ? AND sender = 'assistant'
-                """, (room_id,))
-                if not cursor.fetchone():
-                    message_id = str(uuid.uuid4())
-                    cursor.execute(
-                        "INSERT INTO chat_history (message_id, room_id, sender, message) VALUES (?, ?, ?, ?)",
-                        (message_id, room_id, "assistant", f"What's the overall vibe you're going for in your {room_name}?")
-                    )
-            
-            conn.commit()
-            
+            assistant_message = gemini.generate(payload)
         except Exception as e:
-            print(f"Summary Error: {e}")
+            log.warning("Summary Error: %s", e)
             assistant_message = "Sorry, I couldn’t generate the summary. Let’s proceed to room design."
     else:
-        if user_message:
-            formatted_history.append({"role": "user", "parts": [{"text": user_message}]})
-        
         formatted_history.insert(0, {"role": "assistant", "parts": [{"text": system_instruction}]})
         
         payload = {
@@ -519,14 +640,6 @@ Return only the structured summary text."""
             "generationConfig": {"temperature": 0.2, "maxOutputTokens": 100}
         }
         
-        try:
-            response = requests.post(GEMINI_URL, json=payload)
-            response_data = response.json()
-            assistant_message = response_data['candidates'][0]['content']['parts'][0]['text']
-        except Exception as e:
-            print(f"Gemini Error: {e}")
-            assistant_message = "Sorry, I’m having trouble. What’s next for your house?"
-        
         if user_message:
             extract_prompt = f"""Based on the user message: '{user_message}', identify house details, rooms, or room-specific details.
 
@@ -548,115 +661,84 @@ Return JSON:
     ]
 }}
 
+Use detail_type values such as {', '.join(local_extractor.HOUSE_DETAIL_TYPES)} for house details.
 Only extract explicit details/rooms. Return empty arrays if none."""
             
-            extract_payload = {
-                "contents": [{"role": "user", "parts": [{"text": extract_prompt}]}],
-                "generationConfig": {"temperature": 0.1, "maxOutputTokens": 1024}
-            }
+            extract_future = extraction.submit(conn, "house", extract_prompt, user_message)
+        
+        def save_reply(assistant_message):
+            if user_message:
+                try:
+                    details_data = gemini.wait(extract_future)
+                    
+                    upsert_house_details(cursor, project_id, details_data.house_details)
+                    if details_data.rooms:
+                        insert_rooms(cursor, project_floor(cursor, project_id), details_data.rooms)
+                    upsert_room_details(cursor, project_id, details_data.room_details)
             
-            try:
-                extract_response = requests.post(GEMINI_URL, json=extract_payload)
-                extract_data = extract_response.json()
-                extract_text = extract_data['candidates'][0]['content']['parts'][0]['text']
-                json_match = re.search(r'```json\s*(.*?)\s*```', extract_text, re.DOTALL)
-                if json_match:
-                    extract_text = json_match.group(1)
-                details_data = json.loads(extract_text)
-                
-                for detail in details_data.get('house_details', []):
-                    cursor.execute("""
-                        SELECT detail_id
-                        FROM house_details
-                        WHERE project_id = ? AND detail_type = ?
-                    """, (project_id, detail['detail_type']))
-                    if not cursor.fetchone():
-                        detail_id = str(uuid.uuid4())
-                        cursor.execute(
-                            "INSERT INTO house_details (detail_id, project_id, detail_type, detail_value) VALUES (?, ?, ?, ?)",
-                            (detail_id, project_id, detail['detail_type'], detail['detail_value'])
-                        )
-                
-                for room in details_data.get('rooms', []):
+                except Exception as e:
+                    log.warning("Extract Error: %s", e)
+            
+                if any(keyword in user_message.lower() for keyword in ['parking', 'garden', 'balcony']):
                     cursor.execute("""
-                        SELECT room_id
-                        FROM rooms
-                        WHERE floor_id IN (SELECT floor_id FROM floors WHERE project_id = ?) AND room_name = ?
-                    """, (project_id, room))
+                        SELECT area_id
+                        FROM outer_areas
+                        WHERE project_id = ? AND description = ?
+                    """, (project_id, user_message))
                     if not cursor.fetchone():
-                        floor_id = cursor.execute(
-                            "SELECT floor_id FROM floors WHERE project_id = ? LIMIT 1", (project_id,)
-                        ).fetchone()
-                        if not floor_id:
-                            floor_id = str(uuid.uuid4())
-                            cursor.execute(
-                                "INSERT INTO floors (floor_id, project_id, floor_number) VALUES (?, ?, ?)",
-                                (floor_id, project_id, 1)
-                            )
-                        else:
-                            floor_id = floor_id[0]
-                        room_id = str(uuid.uuid4())
+                        area_id = str(uuid.uuid4())
+                        area_type = next((k for k in ['parking', 'garden', 'balcony'] if k in user_message.lower()), "other")
                         cursor.execute(
-                            "INSERT INTO rooms (room_id, floor_id, room_name) VALUES (?, ?, ?)",
-                            (room_id, floor_id, room)
+                            "INSERT INTO outer_areas (area_id, project_id, area_type, description) VALUES (?, ?, ?, ?)",
+                            (area_id, project_id, area_type, user_message)
                         )
-                
-                for room_detail in details_data.get('room_details', []):
-                    cursor.execute("""
-                        SELECT room_id
-                        FROM rooms
-                        WHERE floor_id IN (SELECT floor_id FROM floors WHERE project_id = ?) AND room_name = ?
-                    """, (project_id, room_detail['room_name']))
-                    room = cursor.fetchone()
-                    if room:
-                        room_id = room[0]
-                        cursor.execute("""
-                            SELECT detail_id
-                            FROM room_details
-                            WHERE room_id = ? AND detail_type = ?
-                        """, (room_id, room_detail['detail_type']))
-                        if not cursor.fetchone():
-                            detail_id = str(uuid.uuid4())
-                            cursor.execute(
-                                "INSERT INTO room_details (detail_id, room_id, detail_type, detail_value) VALUES (?, ?, ?, ?)",
-                                (detail_id, room_id, room_detail['detail_type'], room_detail['detail_value'])
-                            )
-            
-            except Exception as e:
-                print(f"Extract Error: {e}")
-            
-            if any(keyword in user_message.lower() for keyword in ['parking', 'garden', 'balcony']):
-                cursor.execute("""
-                    SELECT area_id
-                    FROM outer_areas
-                    WHERE project_id = ? AND description = ?
-                """, (project_id, user_message))
-                if not cursor.fetchone():
-                    area_id = str(uuid.uuid4())
-                    area_type = next((k for k in ['parking', 'garden', 'balcony'] if k in user_message.lower()), "other")
-                    cursor.execute(
-                        "INSERT INTO outer_areas (area_id, project_id, area_type, description) VALUES (?, ?, ?, ?)",
-                        (area_id, project_id, area_type, user_message)
-                    )
             
+            save_setup_message(cursor, project_id, assistant_message)
             conn.commit()
+        
+        fallback_message = "Sorry, I’m having trouble. What’s next for your house?"
+        if stream:
+            return event_stream(payload, fallback_message,
+                                lambda assistant_message, completed: save_reply(assistant_message))
+        
+        reply_future = gemini.submit(payload)
+        try:
+            assistant_message = gemini.wait(reply_future)
+        except Exception as e:
+            log.warning("Gemini Error: %s", e)
+            assistant_message = fallback_message
+        
+        save_reply(assistant_message)
+        return jsonify({"message": assistant_message})
     
-    message_id = str(uuid.uuid4())
-    cursor.execute(
-        "INSERT INTO setup_chat_history (message_id, project_id, sender, message) VALUES (?, ?, ?, ?)",
-        (message_id, project_id, "assistant", assistant_message)
-    )
+    save_setup_message(cursor, project_id, assistant_message)
     conn.commit()
-    conn.close()
     
+    if stream:
+        return message_stream(assistant_message)
     return jsonify({"message": assistant_message})
 
-@app.route('/api/project/<project_id>/confirm-rooms', methods=['POST'])
+@route('/api/project/<project_id>/setup-chat/history', methods=['GET'])
+@login_required
+def project_setup_history(project_id):
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT 1 FROM projects WHERE project_id = ? AND user_id = ?", (project_id, session['user_id']))
+    if not cursor.fetchone():
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    page = history_page(cursor, "project", project_id,
+                        before=request.args.get('before'),
+                        limit=request.args.get('limit', PAGE_SIZE, type=int))
+    return jsonify(page.to_json())
+
+@route('/api/project/<project_id>/confirm-rooms', methods=['POST'])
 @login_required
 def confirm_rooms(project_id):
     user_message = request.json.get('message', '')
     
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -668,7 +750,6 @@ def confirm_rooms(project_id):
     project = cursor.fetchone()
     
     if not project:
-        conn.close()
         return jsonify({"error": "Unauthorized"}), 403
     
     project_name = project[0]
@@ -681,20 +762,7 @@ def confirm_rooms(project_id):
     
     current_rooms = [row[0] for row in cursor.fetchall()]
     
-    cursor.execute("""
-        SELECT sender, message
-        FROM setup_chat_history
-        WHERE project_id = ?
-        ORDER BY timestamp
-        LIMIT 20
-    """, (project_id,))
-    
-    chat_history = cursor.fetchall()
-    
-    formatted_history = []
-    for sender, message in chat_history:
-        role = "user" if sender == "user" else "assistant"
-        formatted_history.append({"role": role, "parts": [{"text": message}]})
+    formatted_history = history_window(cursor, "project", project_id).contents()
     
     if user_message:
         formatted_history.append({"role": "user", "parts": [{"text": user_message}]})
@@ -724,9 +792,7 @@ Return only the response text."""
             "contents": formatted_history,
             "generationConfig": {"temperature": 0.2, "maxOutputTokens": 100}
         }
-        response = requests.post(GEMINI_URL, json=payload)
-        response_data = response.json()
-        assistant_message = response_data['candidates'][0]['content']['parts'][0]['text']
+        reply_future = gemini.submit(payload)
         
         if user_message:
             extract_prompt = f"""Based on user message: '{user_message}', identify rooms to add/remove.
@@ -739,107 +805,53 @@ Return JSON:
 
 Return empty arrays if none."""
             
-            extract_payload = {
-                "contents": [{"role": "user", "parts": [{"text": extract_prompt}]}],
-                "generationConfig": {"temperature": 0.1, "maxOutputTokens": 1024}
-            }
-            
-            extract_response = requests.post(GEMINI_URL, json=extract_payload)
-            extract_data = extract_response.json()
-            extract_text = extract_data['candidates'][0]['content']['parts'][0]['text']
-            json_match = re.search(r'```json\s*(.*?)\s*```', extract_text, re.DOTALL)
-            if json_match:
-                extract_text = json_match.group(1)
-            rooms_data = json.loads(extract_text)
+            extract_future = extraction.submit(conn, "room_list", extract_prompt, user_message)
+        
+        assistant_message = gemini.wait(reply_future)
+        
+        if user_message:
+            rooms_data = gemini.wait(extract_future)
             
-            floor_id = cursor.execute(
-                "SELECT floor_id FROM floors WHERE project_id = ? LIMIT 1", (project_id,)
-            ).fetchone()
-            if not floor_id:
-                floor_id = str(uuid.uuid4())
-                cursor.execute(
-                    "INSERT INTO floors (floor_id, project_id, floor_number) VALUES (?, ?, ?)",
-                    (floor_id, project_id, 1)
-                )
-            else:
-                floor_id = floor_id[0]
+            floor_id = project_floor(cursor, project_id)
             
             # Update new_rooms based on removals and additions
-            for room in rooms_data.get('remove', []):
-                cursor.execute(
-                    "DELETE FROM rooms WHERE floor_id = ? AND room_name = ?",
-                    (floor_id, room)
-                )
+            cursor.executemany(
+                "DELETE FROM rooms WHERE floor_id = ? AND room_name = ?",
+                [(floor_id, room) for room in rooms_data.remove]
+            )
+            for room in rooms_data.remove:
                 if room in new_rooms:
                     new_rooms.remove(room)
             
-            for room in rooms_data.get('add', []):
-                cursor.execute("""
-                    SELECT room_id
-                    FROM rooms
-                    WHERE floor_id = ? AND room_name = ?
-                """, (floor_id, room))
-                if not cursor.fetchone():
-                    room_id = str(uuid.uuid4())
-                    cursor.execute(
-                        "INSERT INTO rooms (room_id, floor_id, room_name, confirmed) VALUES (?, ?, ?, ?)",
-                        (room_id, floor_id, room, 0)
-                    )
-                    new_rooms.append(room)
+            insert_rooms(cursor, floor_id, rooms_data.add)
+            new_rooms.extend(room for room in dict.fromkeys(rooms_data.add) if room not in new_rooms)
             
             # If user confirms, include current rooms
             if user_message.lower().startswith('yes'):
-                for room in current_rooms:
-                    cursor.execute("""
-                        SELECT room_id
-                        FROM rooms
-                        WHERE floor_id = ? AND room_name = ?
-                    """, (floor_id, room))
-                    if not cursor.fetchone():
-                        room_id = str(uuid.uuid4())
-                        cursor.execute(
-                            "INSERT INTO rooms (room_id, floor_id, room_name, confirmed) VALUES (?, ?, ?, ?)",
-                            (room_id, floor_id, room, 1)
-                        )
+                insert_rooms(cursor, floor_id, current_rooms, confirmed=1)
             
             conn.commit()
             
             # Update system_instruction with new_rooms for the response
-            if rooms_data.get('add') or rooms_data.get('remove'):
+            if rooms_data.add or rooms_data.remove:
                 system_instruction = f"""You’re a house design assistant for project '{project_name}'. Current rooms: {', '.join(current_rooms) or 'None'}. User modified the room list. Updated rooms: {', '.join(new_rooms) or 'None'}. Respond: 'Updated rooms: {', '.join(new_rooms)}. Is this final?'"""
                 formatted_history[-1] = {"role": "assistant", "parts": [{"text": system_instruction}]}
                 payload = {
                     "contents": formatted_history,
                     "generationConfig": {"temperature": 0.2, "maxOutputTokens": 100}
                 }
-                response = requests.post(GEMINI_URL, json=payload)
-                response_data = response.json()
-                assistant_message = response_data['candidates'][0]['content']['parts'][0]['text']
+                assistant_message = gemini.generate(payload)
             
             if user_message.lower().startswith('yes') or 'confirmed' in assistant_message.lower():
                 cursor.execute(
                     "UPDATE rooms SET confirmed = 1 WHERE floor_id IN (SELECT floor_id FROM floors WHERE project_id = ?)",
                     (project_id,)
                 )
-                conn.commit()
-                
-                cursor.execute("""
-                    SELECT room_id, room_name
-                    FROM rooms
-                    WHERE floor_id IN (SELECT floor_id FROM floors WHERE project_id = ?)
-                """, (project_id,))
-                
-                for room_id, room_name in cursor.fetchall():
-                    message_id = str(uuid.uuid4())
-                    cursor.execute(
-                        "INSERT INTO chat_history (message_id, room_id, sender, message) VALUES (?, ?, ?, ?)",
-                        (message_id, room_id, "assistant", f"What's the overall vibe you're going for in your {room_name}?")
-                    )
-                
+                seed_room_greetings(cursor, project_id)
                 conn.commit()
         
     except Exception as e:
-        print(f"Room Confirm Error: {e}")
+        log.warning("Room Confirm Error: %s", e)
         assistant_message = "Sorry, I’m having trouble confirming rooms. What rooms do you want?"
     
     message_id = str(uuid.uuid4())
@@ -848,46 +860,31 @@ Return empty arrays if none."""
         (message_id, project_id, "assistant", assistant_message)
     )
     conn.commit()
-    conn.close()
     
     return jsonify({"message": assistant_message})
 
-@app.route('/project/<project_id>')
+@route('/project/<project_id>')
 @login_required
 def project_view(project_id):
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute(
-        "SELECT project_name FROM projects WHERE project_id = ? AND user_id = ?",
-        (project_id, session['user_id'])
-    )
-    project = cursor.fetchone()
+    snapshot = load_snapshot(cursor, project_id, session['user_id'], with_room_details=False)
     
-    if not project:
-        conn.close()
+    if not snapshot:
         return redirect(url_for('dashboard'))
     
-    cursor.execute("""
-        SELECT r.room_id, r.room_name, f.floor_number
-        FROM rooms r
-        JOIN floors f ON r.floor_id = f.floor_id
-        WHERE f.project_id = ? AND r.confirmed = 1
-        ORDER BY f.floor_number, r.room_name
-    """, (project_id,))
-    
-    rooms = cursor.fetchall()
-    conn.close()
+    rooms = [(room.room_id, room.room_name, room.floor_number) for room in snapshot.confirmed_rooms]
     
     return render_template('project_view.html', 
                           project_id=project_id, 
-                          project_name=project[0], 
+                          project_name=snapshot.project_name, 
                           rooms=rooms)
 
-@app.route('/room/<room_id>/chat')
+@route('/room/<room_id>/chat')
 @login_required
 def room_chat(room_id):
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -901,37 +898,13 @@ def room_chat(room_id):
     room_info = cursor.fetchone()
     
     if not room_info:
-        conn.close()
         return redirect(url_for('dashboard'))
     
-    cursor.execute("""
-        SELECT message_id, sender, message, timestamp
-        FROM chat_history
-        WHERE room_id = ?
-        ORDER BY timestamp
-    """, (room_id,))
-    
-    chat_history = cursor.fetchall()
-    
-    cursor.execute("""
-        SELECT detail_type, detail_value
-        FROM room_details
-        WHERE room_id = ?
-    """, (room_id,))
+    history = history_page(cursor, "room", room_id)
     
-    room_details = cursor.fetchall()
-    
-    cursor.execute("""
-        SELECT r.room_id, r.room_name, f.floor_number
-        FROM rooms r
-        JOIN floors f ON r.floor_id = f.floor_id
-        WHERE f.project_id = ? AND r.confirmed = 1
-        ORDER BY f.floor_number, r.room_name
-    """, (room_info[3],))
-    
-    all_rooms = cursor.fetchall()
-    
-    conn.close()
+    snapshot = load_snapshot(cursor, room_info[3])
+    room_details = snapshot.room(room_id).detail_rows
+    all_rooms = [(room.room_id, room.room_name, room.floor_number) for room in snapshot.confirmed_rooms]
     
     return render_template('room_chat.html',
                           room_id=room_id,
@@ -939,20 +912,43 @@ def room_chat(room_id):
                           floor_number=room_info[2],
                           project_id=room_info[3],
                           project_name=room_info[4],
-                          chat_history=chat_history,
+                          chat_history=history.messages,
+                          history_before=history.before,
                           room_details=room_details,
                           all_rooms=all_rooms)
 
-@app.route('/api/chat/<room_id>', methods=['POST'])
+@route('/api/chat/<room_id>/history', methods=['GET'])
+@login_required
+def room_chat_history(room_id):
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        SELECT 1
+        FROM rooms r
+        JOIN floors f ON r.floor_id = f.floor_id
+        JOIN projects p ON f.project_id = p.project_id
+        WHERE r.room_id = ? AND p.user_id = ?
+    """, (room_id, session['user_id']))
+    if not cursor.fetchone():
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    page = history_page(cursor, "room", room_id,
+                        before=request.args.get('before'),
+                        limit=request.args.get('limit', PAGE_SIZE, type=int))
+    return jsonify(page.to_json())
+
+@route('/api/chat/<room_id>', methods=['POST'])
+@route('/api/chat/<room_id>/stream', methods=['POST'], defaults={'stream': True})
 @login_required
-def process_message(room_id):
+def process_message(room_id, stream=False):
     user_message = request.json.get('message')
     
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("""
-        SELECT r.room_name, f.floor_number, p.project_name
+        SELECT r.room_name, f.floor_number, p.project_name, p.project_id
         FROM rooms r
         JOIN floors f ON r.floor_id = f.floor_id
         JOIN projects p ON f.project_id = p.project_id
@@ -962,10 +958,9 @@ def process_message(room_id):
     room_info = cursor.fetchone()
     
     if not room_info:
-        conn.close()
         return jsonify({"error": "Unauthorized"}), 403
     
-    room_name, floor_number, project_name = room_info
+    room_name, floor_number, project_name, project_id = room_info
     
     message_id = str(uuid.uuid4())
     cursor.execute(
@@ -974,14 +969,10 @@ def process_message(room_id):
     )
     conn.commit()
     
-    # Initialize required details
-    required_details = [
-        'atmosphere', 'color_scheme', 'style', 'budget', 'activities', 'furniture',
-        'lighting', 'textures', 'dimensions', 'storage', 'flooring', 'wall_treatments',
-        'windows', 'decor', 'technology', 'accessibility', 'sustainability'
-    ]
+    # Design progress is kept as a persisted state machine, so only this message needs inspecting
+    state = room_state.load_state(cursor, room_id)
     
-    # Check current state from room_design_questions
+    # Check current answers from room_design_questions
     cursor.execute("""
         SELECT question_type, answer, is_complete
         FROM room_design_questions
@@ -989,16 +980,13 @@ def process_message(room_id):
         ORDER BY created_at
     """, (room_id,))
     design_state = {row[0]: {'answer': row[1], 'is_complete': row[2]} for row in cursor.fetchall()}
-    missing_details = [d for d in required_details if d not in design_state or not design_state[d]['is_complete']]
-    is_confirmed = any('confirmed' in msg.lower() or 'yes' in msg.lower() for _, msg in cursor.execute("""
-        SELECT message FROM chat_history WHERE room_id = ? AND sender = 'user'
-    """, (room_id,)).fetchall())
-    
-    # Check if room design is already initiated
-    cursor.execute("""
-        SELECT COUNT(*) FROM room_design_questions WHERE room_id = ?
-    """, (room_id,))
-    design_initiated = cursor.fetchone()[0] > 0
+    completed_types = {k for k, v in design_state.items() if v['is_complete']}
+    # The persisted stage drives this turn; answers merged in from a duplicate room can leave it behind
+    if state['stage'] == room_state.GATHERING and state['next_detail'] in completed_types:
+        room_state.advance(state, completed_types)
+    if not state['confirmed'] and room_state.is_confirmation(user_message, state):
+        state['confirmed'] = True
+    is_confirmed = state['confirmed']
     
     # Enhanced detail extraction
     extract_prompt = f"""Based on user message: '{user_message}', identify design details for the {room_name}. Handle structured input like 'Kitchen: ample shelves, marble sink, ...' by parsing all listed items.
@@ -1017,70 +1005,55 @@ Return JSON:
     ]
 }}
 
+Use detail_type values from: {', '.join(room_state.REQUIRED_DETAILS)}.
 Extract ALL explicit details, including from structured formats (e.g., 'Room: detail1, detail2'). Return empty array if none."""
     
-    extract_payload = {
-        "contents": [{"role": "user", "parts": [{"text": extract_prompt}]}],
-        "generationConfig": {"temperature": 0.1, "maxOutputTokens": 1024}
-    }
+    # The reply below is chosen from the state loaded before this message, so
+    # extraction and reply generation can run at the same time
+    extract_future = extraction.submit(conn, "room", extract_prompt, user_message)
+    cache_key = None
+    cached_reply = None
     
-    try:
-        extract_response = requests.post(GEMINI_URL, json=extract_payload)
-        extract_data = extract_response.json()
-        extract_text = extract_data['candidates'][0]['content']['parts'][0]['text']
-        json_match = re.search(r'```json\s*(.*?)\s*```', extract_text, re.DOTALL)
-        if json_match:
-            extract_text = json_match.group(1)
-        details_data = json.loads(extract_text)
-        
-        for detail in details_data.get('details', []):
-            if detail['detail_type'] not in design_state or not design_state[detail['detail_type']]['is_complete']:
-                question_id = str(uuid.uuid4())
-                cursor.execute(
-                    "INSERT INTO room_design_questions (question_id, room_id, question_type, answer, is_complete) VALUES (?, ?, ?, ?, ?)",
-                    (question_id, room_id, detail['detail_type'], detail['detail_value'], 1)
-                )
-                cursor.execute(
-                    "INSERT INTO room_details (detail_id, room_id, detail_type, detail_value) VALUES (?, ?, ?, ?)",
-                    (str(uuid.uuid4()), room_id, detail['detail_type'], detail['detail_value'])
-                )
-    except Exception as e:
-        print(f"Extract Error: {e}")
-    
-    # Determine next action with session-based tracking
-    session.setdefault(f'design_{room_id}', {'last_action': 'start'})
-    if session[f'design_{room_id}']['last_action'] == 'confirmed':
-        missing_details = []
-        is_confirmed = True
-    
-    if missing_details and not is_confirmed:
-        next_detail = missing_details[0]
+    if state['stage'] == room_state.GATHERING and not is_confirmed:
+        next_detail = state['next_detail']
         current_answers = {k: v['answer'] for k, v in design_state.items() if v['answer']}
         
-        system_instruction = f"""You’re an expert interior designer for the {room_name} on floor {floor_number} of project '{project_name}'. Craft a detailed, inspiring question to gather the next design detail for this room. The next detail to ask about is '{next_detail}'. Use the user's prior answers to tailor your suggestion:
+        if llm_cache.ENABLED:
+            # Cached questions are shared between users, so the prompt is built from
+            # the cache key alone: no project name, conversation or verbatim answers
+            answers = llm_cache.bucket_answers(current_answers)
+            room_label = llm_cache.room_label(room_name)
+            cache_key = llm_cache.cache_key("question", room=room_label, next_detail=next_detail, answers=answers)
+            cached_reply = llm_cache.get(conn, "question", cache_key)
+            designer = f"the {room_label}"
+            prior_answers = ', '.join(f'{k}: {v}' for k, v in answers.items()) or 'None'
+            recent_conversation = ""
+        else:
+            designer = f"the {room_name} on floor {floor_number} of project '{project_name}'"
+            prior_answers = ', '.join(f'{k}: {v}' for k, v in current_answers.items()) or 'None'
+            recent_conversation = f"""
+Recent conversation:
+{history_window(cursor, "room", room_id, budget=ROOM_TOKEN_BUDGET).transcript()}
+"""
+        
+        system_instruction = f"""You’re an expert interior designer for {designer}. Craft a detailed, inspiring question to gather the next design detail for this room. The next detail to ask about is '{next_detail}'. Use the user's prior answers to tailor your suggestion:
 
 - Be conversational and enthusiastic, e.g., 'Love the vibe so far!'.
 - Provide creative, style-specific ideas based on prior answers (e.g., if 'modern' style, suggest sleek furniture or minimalist decor).
 - Ask ONE question clearly focused on '{next_detail}'.
 - Example: If next_detail is 'lighting' and prior answer is 'cozy', respond: 'Love that cozy vibe! How about warm pendant lights or soft recessed lighting to enhance the ambiance? 💡'
 
-Prior answers: {', '.join(f'{k}: {v}' for k, v in current_answers.items()) or 'None'}.
-"""
+Prior answers: {prior_answers}.
+{recent_conversation}"""
         
         payload = {
             "contents": [{"role": "user", "parts": [{"text": system_instruction}]}],
             "generationConfig": {"temperature": 0.7, "maxOutputTokens": 150}
         }
         
-        try:
-            response = requests.post(GEMINI_URL, json=payload)
-            response_data = response.json()
-            assistant_message = response_data['candidates'][0]['content']['parts'][0]['text']
-            session[f'design_{room_id}']['last_action'] = 'question'
-        except Exception as e:
-            print(f"Gemini Error: {e}")
-            assistant_message = f"Sorry, I’m having trouble. What about {next_detail} for your {room_name}?"
-    elif not missing_details and not is_confirmed:
+        next_action = 'question'
+        fallback_message = f"Sorry, I’m having trouble. What about {next_detail} for your {room_name}?"
+    elif not is_confirmed:
         current_answers = {k: v['answer'] for k, v in design_state.items() if v['is_complete']}
         system_instruction = f"""You’re an expert interior designer for the {room_name} on floor {floor_number} of project '{project_name}'. All required details have been provided. Craft a warm, encouraging message to confirm the design:
 
@@ -1097,14 +1070,8 @@ Confirmed details: {', '.join(f'{k}: {v}' for k, v in current_answers.items()) o
             "generationConfig": {"temperature": 0.7, "maxOutputTokens": 150}
         }
         
-        try:
-            response = requests.post(GEMINI_URL, json=payload)
-            response_data = response.json()
-            assistant_message = response_data['candidates'][0]['content']['parts'][0]['text']
-            session[f'design_{room_id}']['last_action'] = 'confirm'
-        except Exception as e:
-            print(f"Gemini Error: {e}")
-            assistant_message = f"Your {room_name} design looks great! Can we confirm and move to the next room? Say 'yes'."
+        next_action = 'confirm'
+        fallback_message = f"Your {room_name} design looks great! Can we confirm and move to the next room? Say 'yes'."
     else:  # All details complete and confirmed
         cursor.execute("""
             SELECT r.room_id, r.room_name, f.floor_number
@@ -1112,7 +1079,7 @@ Confirmed details: {', '.join(f'{k}: {v}' for k, v in current_answers.items()) o
             JOIN floors f ON r.floor_id = f.floor_id
             WHERE f.project_id = ? AND r.confirmed = 1 AND r.room_id != ?
             ORDER BY f.floor_number, r.room_name
-        """, (room_info[3], room_id))
+        """, (project_id, room_id))
         next_rooms = cursor.fetchall()
         
         system_instruction = f"""You’re an expert interior designer for the {room_name} on floor {floor_number} of project '{project_name}'. The {room_name} design is complete and confirmed. Craft an enthusiastic message to suggest the next step:
@@ -1130,174 +1097,145 @@ Next rooms: {', '.join(f'{r[1]} (Floor {r[2]})' for r in next_rooms) or 'None'}.
             "generationConfig": {"temperature": 0.7, "maxOutputTokens": 150}
         }
         
+        next_action = 'completed'
+        fallback_message = f"Awesome, {room_name} is done! Want to move to another room or finalize? 🏡"
+    
+    def apply_extraction():
+        added_types = set()
         try:
-            response = requests.post(GEMINI_URL, json=payload)
-            response_data = response.json()
-            assistant_message = response_data['candidates'][0]['content']['parts'][0]['text']
-            session[f'design_{room_id}']['last_action'] = 'completed'
+            details_data = gemini.wait(extract_future)
+            
+            details = join_detail_values(
+                [detail for detail in details_data.details if detail.detail_type not in completed_types],
+                lambda detail: detail.detail_type
+            )
+            cursor.executemany("""
+                INSERT INTO room_design_questions (question_id, room_id, question_type, answer, is_complete) VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT (room_id, question_type) DO UPDATE SET answer = excluded.answer, is_complete = 1
+            """, [(str(uuid.uuid4()), room_id, detail_type, detail_value) for detail_type, detail_value in details])
+            cursor.executemany("""
+                INSERT INTO room_details (detail_id, room_id, detail_type, detail_value) VALUES (?, ?, ?, ?)
+                ON CONFLICT (room_id, detail_type) DO UPDATE SET detail_value = excluded.detail_value
+            """, [(str(uuid.uuid4()), room_id, detail_type, detail_value) for detail_type, detail_value in details])
+            added_types.update(detail_type for detail_type, _ in details)
         except Exception as e:
-            print(f"Gemini Error: {e}")
-            assistant_message = f"Awesome, {room_name} is done! Want to move to another room or finalize? 🏡"
+            log.warning("Extract Error: %s", e)
+        return added_types
     
-    message_id = str(uuid.uuid4())
-    cursor.execute(
-        "INSERT INTO chat_history (message_id, room_id, sender, message) VALUES (?, ?, ?, ?)",
-        (message_id, room_id, "assistant", assistant_message)
-    )
-    conn.commit()
-    conn.close()
+    def save_reply(assistant_message, last_action=None):
+        added_types = apply_extraction()
+        room_state.advance(state, completed_types | added_types, last_action)
+        room_state.save_state(cursor, room_id, state)
+        message_id = str(uuid.uuid4())
+        cursor.execute(
+            "INSERT INTO chat_history (message_id, room_id, sender, message) VALUES (?, ?, ?, ?)",
+            (message_id, room_id, "assistant", assistant_message)
+        )
+        conn.commit()
+    
+    if cached_reply is not None:
+        save_reply(cached_reply, next_action)
+        return message_stream(cached_reply) if stream else jsonify({"message": cached_reply})
+    
+    def cache_reply(assistant_message):
+        llm_cache.put(conn, "question", cache_key, assistant_message)
+    
+    if stream:
+        return event_stream(
+            payload, fallback_message,
+            # Same transition as below: a fallback or cut-off reply leaves last_action alone
+            lambda assistant_message, completed: save_reply(assistant_message, next_action if completed else None),
+            on_success=cache_reply if cache_key else None
+        )
+    
+    reply_future = gemini.submit(payload)
+    try:
+        assistant_message = gemini.wait(reply_future)
+        completed_action = next_action
+    except Exception as e:
+        log.warning("Gemini Error: %s", e)
+        assistant_message = fallback_message
+        completed_action = None
+    
+    save_reply(assistant_message, completed_action)
+    if cache_key and completed_action:
+        cache_reply(assistant_message)
     
     return jsonify({"message": assistant_message})
 
-@app.route('/api/project/<project_id>/report', methods=['GET'])
+@route('/api/project/<project_id>/report', methods=['GET', 'POST'])
 @login_required
 def generate_report(project_id):
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute(
-        "SELECT project_name FROM projects WHERE project_id = ? AND user_id = ?",
-        (project_id, session['user_id'])
-    )
-    project = cursor.fetchone()
+    snapshot = load_snapshot(cursor, project_id, session['user_id'])
     
-    if not project:
-        conn.close()
+    if not snapshot:
         return jsonify({"error": "Unauthorized"}), 403
     
-    project_name = project[0]
+    mode = request.args.get('mode', reports.REPORT_MODE)
+    if mode not in reports.REPORT_MODES:
+        return jsonify({"error": f"Unknown report mode: {mode}"}), 400
     
-    cursor.execute("""
-        SELECT detail_type, detail_value
-        FROM house_details
-        WHERE project_id = ?
-    """, (project_id,))
-    
-    house_details = {d[0]: d[1] for d in cursor.fetchall()}
-    
-    cursor.execute("""
-        SELECT area_type, description
-        FROM outer_areas
-        WHERE project_id = ?
-    """, (project_id,))
+    job_id, status = report_jobs.enqueue(conn, project_id, reports.report_key(snapshot, mode), mode)
     
-    outer_areas = {d[0]: d[1] for d in cursor.fetchall()}
+    return jsonify(report_job_json(project_id, job_id, status)), 202
+
+def report_job_json(project_id, job_id, status, error=None):
+    job = {
+        "job_id": job_id,
+        "status": status,
+        "status_url": url_for('report_status', project_id=project_id, job_id=job_id),
+    }
+    if status == report_jobs.DONE:
+        job["download_url"] = url_for('download_report', project_id=project_id, job_id=job_id)
+    if error:
+        job["error"] = "Failed to generate report"
+    return job
+
+@route('/api/project/<project_id>/report/<job_id>', methods=['GET'])
+@login_required
+def report_status(project_id, job_id):
+    conn = get_db()
+    cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT 
-            r.room_id,
-            r.room_name
-        FROM 
-            rooms r
-        JOIN floors f ON r.floor_id = f.floor_id
-        WHERE 
-            f.project_id = ? AND r.confirmed = 1
-        ORDER BY r.room_name
-    """, (project_id,))
+    cursor.execute("SELECT 1 FROM projects WHERE project_id = ? AND user_id = ?", (project_id, session['user_id']))
+    if not cursor.fetchone():
+        return jsonify({"error": "Unauthorized"}), 403
     
-    rooms = cursor.fetchall()
+    job = report_jobs.job_status(conn, project_id, job_id)
+    if not job:
+        return jsonify({"error": "Report job not found"}), 404
     
-    room_details_summary = {}
-    for room_id, room_name in rooms:
-        cursor.execute("""
-            SELECT detail_type, detail_value
-            FROM room_details
-            WHERE room_id = ?
-        """, (room_id,))
-        room_details = {d[0]: d[1] for d in cursor.fetchall()}
-        room_details_summary[room_name] = room_details
-    
-    summary_prompt = f"""Generate a structured summary for project '{project_name}' based on user-provided details only:
-
-House Details:
-{json.dumps(house_details, indent=2)}
-
-Rooms and Their Details:
-{json.dumps({name: details for name, details in room_details_summary.items()}, indent=2)}
-
-Outdoor Areas:
-{json.dumps(outer_areas, indent=2)}
-
-Instructions:
-- Structure the summary with sections like the reference report:
-  - 1. General Information: House type, number of stories.
-  - 2. Rooms & Spaces: Number of bedrooms, bathrooms, additional rooms (e.g., office, gym).
-  - 3. Bedroom Specifications: Details for Master Bedroom, other bedrooms (e.g., closets, windows, bathrooms).
-  - 4. Office Specifications: Size, features (e.g., desk space, lighting).
-  - 5. Gym Specifications: Size, features (e.g., cardio equipment, ventilation).
-  - 6. Living & Dining Area: Layout, special features.
-  - 7. Kitchen Preferences: Layout, lighting, storage.
-  - Overall Summary: A concise, friendly recap with emojis (e.g., 'This multi-story home with a gym and office is going to be amazing! 🏡😍').
-- Include only details explicitly provided by the user (e.g., if style is given, include it; if not, omit it).
-- Do not mention unspecified, missing, or default details.
-- Use bullet points for each section.
-- Example:
-  '1. General Information
-  - House Type: Multi-story
-  - Number of Stories: 2
-  2. Rooms & Spaces
-  - Bedrooms: 3 (Spacious)
-  - Bathrooms: 4
-  - Additional Rooms: Office, Gym
-  3. Bedroom Specifications
-  - Master Bedroom: Spacious with a custom wall texture
-  - Other Bedrooms: Slightly smaller than master, with closets
-  Overall Summary: This multi-story home with a gym and office is going to be amazing! 🏡😍'
+    return jsonify(report_job_json(project_id, job_id, *job))
 
-Return only the structured summary text."""
+@route('/api/project/<project_id>/report/<job_id>/download', methods=['GET'])
+@login_required
+def download_report(project_id, job_id):
+    conn = get_db()
+    cursor = conn.cursor()
     
-    payload = {
-        "contents": [{"role": "user", "parts": [{"text": summary_prompt}]}],
-        "generationConfig": {"temperature": 0.2, "maxOutputTokens": 1024}
-    }
+    cursor.execute("SELECT project_name FROM projects WHERE project_id = ? AND user_id = ?", (project_id, session['user_id']))
+    project = cursor.fetchone()
+    if not project:
+        return jsonify({"error": "Unauthorized"}), 403
     
-    try:
-        response = requests.post(GEMINI_URL, json=payload)
-        response_data = response.json()
-        report_text = response_data['candidates'][0]['content']['parts'][0]['text']
-        
-        report_text = report_text.encode('ascii', 'ignore').decode('ascii')
-        
-        pdf = FPDF()
-        pdf.add_page()
-        
-        pdf.set_font("Arial", "B", 16)
-        pdf.cell(0, 10, f"Summary Report: {project_name}", ln=True, align="C")
-        
-        pdf.set_font("Arial", "I", 10)
-        pdf.cell(0, 10, f"Generated on {datetime.now().strftime('%Y-%m-%d')}", ln=True)
-        
-        pdf.set_font("Arial", "", 12)
-        pdf.multi_cell(0, 10, report_text)
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-            pdf.output(temp_file.name)
-            temp_file_path = temp_file.name
-        
-        pdf_buffer = io.BytesIO()
-        with open(temp_file_path, 'rb') as f:
-            pdf_buffer.write(f.read())
-        pdf_buffer.seek(0)
-        
-        os.unlink(temp_file_path)
-        
-        return send_file(
-            pdf_buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"{project_name}_summary_report.pdf"
-        )
-        
-    except Exception as e:
-        print(f"Report Error: {e}")
-        return jsonify({"error": "Failed to generate report"}), 500
-    finally:
-        conn.close()
+    pdf_bytes = report_jobs.job_result(conn, project_id, job_id)
+    if pdf_bytes is None:
+        return jsonify({"error": "Report is not ready"}), 404
+    
+    return send_file(
+        io.BytesIO(pdf_bytes),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f"{project[0]}_summary_report.pdf"
+    )
 
-@app.route('/delete-project/<project_id>', methods=['POST'])
+@route('/delete-project/<project_id>', methods=['POST'])
 @login_required
 def delete_project(project_id):
-    conn = sqlite3.connect('housing_assistant.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute(
@@ -1307,21 +1245,24 @@ def delete_project(project_id):
     project = cursor.fetchone()
     
     if not project:
-        conn.close()
         return jsonify({"error": "Unauthorized or project not found"}), 403
     
     try:
+        delete_summaries(cursor, project_id)
         cursor.execute(
             "DELETE FROM projects WHERE project_id = ?",
             (project_id,)
         )
         conn.commit()
+        report_cache.invalidate(project_id)
         return jsonify({"success": "Project deleted successfully"})
     except Exception as e:
         conn.rollback()
-        print(f"Delete Error: {e}")
+        log.warning("Delete Error: %s", e)
         return jsonify({"error": f"Failed to delete project: {str(e)}"}), 500
-    finally:
-        conn.close()
+
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080, debug=False)
\ No newline at end of file
@@ -0,0 +1,290 @@
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, before_render_template, g, request, template_rendered
+
+# Counters and histograms are process-wide and exposed in the Prometheus text
+# format on /metrics. Each request additionally collects its spans (queries,
+# LLM calls, template renders) which can be written out as one JSON log line.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+JSON_LOGS = os.getenv("METRICS_JSON_LOGS", "0") == "1"
+# Upper bound on spans kept per request for the log line; totals stay exact
+MAX_SPANS = int(os.getenv("METRICS_MAX_SPANS", 200))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Statements are many and mostly fast, so they get fewer buckets per series
+DB_BUCKETS = (0.0005, 0.002, 0.01, 0.05, 0.25, 1)
+
+log = logging.getLogger(__name__)
+request_log = logging.getLogger("requests")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labelvalues, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labelvalues)
+            if series is None:
+                series = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labelvalues, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {count}")
+        return lines
+
+
+http_requests = Histogram("http_request_duration_seconds", "HTTP request latency", ["endpoint", "method", "status"])
+# Statements are labelled with statement_id(); the full text is in the JSON log spans
+db_queries = Histogram("db_query_duration_seconds", "SQLite statement latency", ["statement"], buckets=DB_BUCKETS)
+db_rows = Counter("db_rows_total", "Rows returned or changed by SQLite statements", ["statement"])
+llm_requests = Histogram("llm_request_duration_seconds", "Gemini call latency including retries", ["call", "outcome"],
+                         buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+llm_retries = Counter("llm_retries_total", "Gemini attempts beyond the first", ["call"])
+llm_tokens = Counter("llm_tokens_total", "Tokens reported in Gemini usageMetadata", ["type"])
+llm_chars = Counter("llm_chars_total", "Characters sent to and received from Gemini", ["type"])
+template_renders = Histogram("template_render_seconds", "Jinja template render time", ["template"])
+
+REGISTRY = [http_requests, db_queries, db_rows, llm_requests, llm_retries, llm_tokens, llm_chars, template_renders]
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalise a statement so every call site maps onto one label value."""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, ...)", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_id(sql):
+    """Short stable label for a statement, e.g. "select_1f3a9c02be"."""
+    statement = fingerprint(sql)
+    verb = statement.split(" ", 1)[0].lower() or "sql"
+    return f"{verb}_{hashlib.sha1(statement.encode('utf-8')).hexdigest()[:10]}"
+
+
+class Trace:
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.status = None
+        self.start = time.perf_counter()
+        self.spans = []
+        self.totals = {"db_queries": 0, "db_seconds": 0.0, "llm_calls": 0, "llm_seconds": 0.0,
+                       "prompt_tokens": 0, "response_tokens": 0, "template_seconds": 0.0}
+        self.lock = threading.Lock()
+
+    def add(self, span, **totals):
+        with self.lock:
+            for key, value in totals.items():
+                self.totals[key] += value
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+
+
+# LLM calls for a request run on executor threads; callers copy the context
+# (contextvars.copy_context) so their spans land on the right request
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def record_query(sql, seconds, rows):
+    label = statement_id(sql)
+    db_queries.observe(seconds, label)
+    if rows > 0:
+        db_rows.inc(rows, label)
+    trace = current_trace.get()
+    if trace is None:
+        return None
+    span = {"kind": "db", "statement_id": label, "statement": fingerprint(sql),
+            "seconds": round(seconds, 6), "rows": max(rows, 0)}
+    trace.add(span, db_queries=1, db_seconds=seconds)
+    return span
+
+
+def record_rows(span, sql, rows):
+    # SELECT row counts are only known once the caller fetches them
+    if rows:
+        db_rows.inc(rows, statement_id(sql))
+        if span is not None:
+            span["rows"] += rows
+
+
+def prompt_chars(payload):
+    return sum(len(part.get("text", "")) for content in payload.get("contents", []) for part in content.get("parts", []))
+
+
+def record_llm(call, seconds, outcome, payload, response_chars=0, usage=None, retries=0):
+    usage = usage or {}
+    sent = prompt_chars(payload)
+    prompt_tokens = usage.get("promptTokenCount", 0)
+    response_tokens = usage.get("candidatesTokenCount", 0)
+    llm_requests.observe(seconds, call, outcome)
+    llm_chars.inc(sent, "prompt")
+    llm_chars.inc(response_chars, "response")
+    if retries:
+        llm_retries.inc(retries, call)
+    if prompt_tokens:
+        llm_tokens.inc(prompt_tokens, "prompt")
+    if response_tokens:
+        llm_tokens.inc(response_tokens, "response")
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add({
+            "kind": "llm", "call": call, "outcome": outcome, "seconds": round(seconds, 6), "retries": retries,
+            "prompt_chars": sent, "response_chars": response_chars,
+            "prompt_tokens": prompt_tokens, "response_tokens": response_tokens,
+        }, llm_calls=1, llm_seconds=seconds, prompt_tokens=prompt_tokens, response_tokens=response_tokens)
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault("_render_starts", []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    starts = g.get("_render_starts")
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    template_renders.observe(seconds, template.name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add({"kind": "template", "template": template.name, "seconds": round(seconds, 6)}, template_seconds=seconds)
+
+
+def _start_request():
+    current_trace.set(Trace(request.endpoint or "unknown", request.method))
+
+
+def _response_status(response):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.status = response.status_code
+        # Closing happens once the body has been sent, so SSE turns are timed in full
+        response.call_on_close(lambda: _finish_request(trace))
+    return response
+
+
+def _finish_request(trace):
+    if current_trace.get() is trace:
+        current_trace.set(None)
+    seconds = time.perf_counter() - trace.start
+    status = trace.status
+    http_requests.observe(seconds, trace.endpoint, trace.method, status)
+    if JSON_LOGS:
+        request_log.info("request", extra={"data": {
+            "endpoint": trace.endpoint, "method": trace.method, "status": status,
+            "seconds": round(seconds, 6), **{k: round(v, 6) if isinstance(v, float) else v for k, v in trace.totals.items()},
+            "spans": trace.spans,
+        }})
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "data", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    root = logging.getLogger()
+    if JSON_LOGS:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        root.handlers = [handler]
+        root.setLevel(logging.INFO)
+    elif not root.handlers:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def metrics_view():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    configure_logging()
+    if not METRICS_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_response_status)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,240 @@
+# Ordered schema migrations applied on top of the base tables created by init_db().
+# Append new steps with the next version number; never edit a released step.
+import room_state
+
+
+def backfill_room_stages(conn):
+    # Rows written before the state machine existed have no next_detail yet
+    completed = {}
+    for room_id, question_type in conn.execute(
+        "SELECT room_id, question_type FROM room_design_questions WHERE is_complete = 1"
+    ).fetchall():
+        completed.setdefault(room_id, set()).add(question_type)
+    rows = conn.execute(
+        "SELECT room_id, confirmed, last_action FROM room_design_state WHERE stage != ? OR next_detail IS NULL",
+        (room_state.CONFIRMED,)
+    ).fetchall()
+    for room_id, confirmed, last_action in rows:
+        state = room_state.advance({'confirmed': bool(confirmed), 'last_action': last_action},
+                                   completed.get(room_id, set()))
+        conn.execute(
+            "UPDATE room_design_state SET stage = ?, next_detail = ? WHERE room_id = ?",
+            (state['stage'], state['next_detail'], room_id)
+        )
+
+
+MIGRATIONS = [
+    (1, "secondary indexes for hot lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_projects_user_created ON projects (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_house_details_project_type ON house_details (project_id, detail_type)",
+        "CREATE INDEX IF NOT EXISTS idx_outer_areas_project ON outer_areas (project_id, area_type)",
+        "CREATE INDEX IF NOT EXISTS idx_floors_project ON floors (project_id, floor_number)",
+        "CREATE INDEX IF NOT EXISTS idx_rooms_floor_name ON rooms (floor_id, room_name)",
+        "CREATE INDEX IF NOT EXISTS idx_room_details_room_type ON room_details (room_id, detail_type)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_room_ts ON chat_history (room_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_setup_chat_history_project_ts ON setup_chat_history (project_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_room_design_questions_room ON room_design_questions (room_id, created_at)",
+    ]),
+    (2, "server-side sessions and per-room design progress", [
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)",
+        """
+        CREATE TABLE IF NOT EXISTS room_design_state (
+            room_id TEXT PRIMARY KEY,
+            last_action TEXT NOT NULL DEFAULT 'start',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (room_id) REFERENCES rooms (room_id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (3, "explicit room design state machine", [
+        "ALTER TABLE room_design_state ADD COLUMN stage TEXT NOT NULL DEFAULT 'gathering'",
+        "ALTER TABLE room_design_state ADD COLUMN next_detail TEXT",
+        "ALTER TABLE room_design_state ADD COLUMN confirmed INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE room_design_state ADD COLUMN details_completed INTEGER NOT NULL DEFAULT 0",
+        "UPDATE room_design_state SET confirmed = 1, stage = 'confirmed' WHERE last_action = 'completed'",
+    ]),
+    (4, "rolling conversation summaries", [
+        """
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            scope TEXT NOT NULL,
+            scope_id TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            covered_timestamp TIMESTAMP NOT NULL,
+            covered_rowid INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (scope, scope_id)
+        )
+        """,
+    ]),
+    (5, "unique natural keys for rooms and extracted details", [
+        # Duplicate rooms are folded into the oldest one, keeping their chat and details
+        """
+        CREATE TEMP TABLE room_merge AS
+        SELECT r.room_id AS duplicate_id, k.room_id AS keep_id
+        FROM rooms r
+        JOIN (SELECT floor_id, room_name, MIN(rowid) AS keep_rowid FROM rooms GROUP BY floor_id, room_name) m
+            ON m.floor_id = r.floor_id AND m.room_name = r.room_name AND m.keep_rowid != r.rowid
+        JOIN rooms k ON k.rowid = m.keep_rowid
+        """,
+        """
+        UPDATE rooms SET confirmed = 1
+        WHERE room_id IN (SELECT keep_id FROM room_merge m JOIN rooms d ON d.room_id = m.duplicate_id WHERE d.confirmed = 1)
+        """,
+        "UPDATE chat_history SET room_id = (SELECT keep_id FROM room_merge WHERE duplicate_id = room_id) WHERE room_id IN (SELECT duplicate_id FROM room_merge)",
+        "UPDATE room_details SET room_id = (SELECT keep_id FROM room_merge WHERE duplicate_id = room_id) WHERE room_id IN (SELECT duplicate_id FROM room_merge)",
+        "UPDATE room_design_questions SET room_id = (SELECT keep_id FROM room_merge WHERE duplicate_id = room_id) WHERE room_id IN (SELECT duplicate_id FROM room_merge)",
+        "DELETE FROM chat_summaries WHERE scope = 'room' AND scope_id IN (SELECT duplicate_id FROM room_merge)",
+        "DELETE FROM rooms WHERE room_id IN (SELECT duplicate_id FROM room_merge)",
+        "DROP TABLE temp.room_merge",
+        # Readers take the most recent house detail per type, so that is the row kept
+        "DELETE FROM house_details WHERE rowid NOT IN (SELECT MAX(rowid) FROM house_details GROUP BY project_id, detail_type)",
+        # Rooms collect several values per type ("sink" and "stools" are both furniture),
+        # so those are folded into the kept row before the others go
+        """
+        UPDATE room_details SET detail_value = (
+            SELECT group_concat(detail_value, ', ') FROM (
+                SELECT DISTINCT d.detail_value FROM room_details d
+                WHERE d.room_id = room_details.room_id AND d.detail_type = room_details.detail_type
+                ORDER BY d.rowid
+            )
+        )
+        WHERE rowid IN (SELECT MAX(rowid) FROM room_details GROUP BY room_id, detail_type HAVING COUNT(*) > 1)
+        """,
+        "DELETE FROM room_details WHERE rowid NOT IN (SELECT MAX(rowid) FROM room_details GROUP BY room_id, detail_type)",
+        """
+        UPDATE room_design_questions SET
+            answer = (
+                SELECT group_concat(answer, ', ') FROM (
+                    SELECT DISTINCT q.answer FROM room_design_questions q
+                    WHERE q.room_id = room_design_questions.room_id AND q.question_type = room_design_questions.question_type
+                    ORDER BY q.rowid
+                )
+            ),
+            is_complete = (
+                SELECT MAX(q.is_complete) FROM room_design_questions q
+                WHERE q.room_id = room_design_questions.room_id AND q.question_type = room_design_questions.question_type
+            )
+        WHERE rowid IN (SELECT MAX(rowid) FROM room_design_questions GROUP BY room_id, question_type HAVING COUNT(*) > 1)
+        """,
+        "DELETE FROM room_design_questions WHERE rowid NOT IN (SELECT MAX(rowid) FROM room_design_questions GROUP BY room_id, question_type)",
+        "DROP INDEX IF EXISTS idx_house_details_project_type",
+        "DROP INDEX IF EXISTS idx_rooms_floor_name",
+        "DROP INDEX IF EXISTS idx_room_details_room_type",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_house_details_project_type ON house_details (project_id, detail_type)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_rooms_floor_name ON rooms (floor_id, room_name)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_room_details_room_type ON room_details (room_id, detail_type)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_room_design_questions_room_type ON room_design_questions (room_id, question_type)",
+    ]),
+    (6, "background report jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            job_id TEXT PRIMARY KEY,
+            project_id TEXT NOT NULL,
+            snapshot_key TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            pdf BLOB,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            FOREIGN KEY (project_id) REFERENCES projects (project_id) ON DELETE CASCADE
+        )
+        """,
+        # At most one queued or running job per project; duplicate requests share it
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_report_jobs_active ON report_jobs (project_id) WHERE status IN ('queued', 'running')",
+        "CREATE INDEX IF NOT EXISTS idx_report_jobs_status ON report_jobs (status, created_at)",
+    ]),
+    (7, "report jobs per report mode", [
+        "ALTER TABLE report_jobs ADD COLUMN mode TEXT NOT NULL DEFAULT 'llm'",
+        "DROP INDEX IF EXISTS uq_report_jobs_active",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_report_jobs_active ON report_jobs (project_id, mode) WHERE status IN ('queued', 'running')",
+    ]),
+    (8, "shared LLM response cache", [
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            prompt_class TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used_at)",
+    ]),
+    (9, "memoized extraction results", [
+        """
+        CREATE TABLE IF NOT EXISTS extraction_cache (
+            cache_key TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache (last_used_at)",
+    ]),
+    (10, "room stage and next detail are read back from room_design_state", [
+        backfill_room_stages,
+        "ALTER TABLE room_design_state DROP COLUMN details_completed",
+    ]),
+]
+
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def is_current(conn):
+    # Read-only check so already-migrated workers skip the schema lock entirely
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone():
+        return False
+    return (conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0) >= LATEST_VERSION
+
+
+def current_version(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    version = current_version(conn)
+    conn.commit()
+    applied = []
+    for step_version, description, steps in MIGRATIONS:
+        if step_version <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied this step while we waited for the lock
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (step_version,)).fetchone():
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (step_version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(step_version)
+    return applied
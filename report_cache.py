@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Bump when the report prompt or PDF layout changes so stale renders are not served
+PROMPT_VERSION = "2"
+
+MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", 256))
+MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+def snapshot_key(project_name, house_details, room_details_summary, outer_areas, mode="llm"):
+    snapshot = {
+        "prompt_version": PROMPT_VERSION,
+        "mode": mode,
+        "project_name": project_name,
+        "house_details": house_details,
+        "room_details": room_details_summary,
+        "outer_areas": outer_areas,
+    }
+    serialized = json.dumps(snapshot, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ReportCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.project_keys = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, project_id, key, summary, pdf_bytes, mode="llm"):
+        entry = {"project_id": project_id, "mode": mode, "summary": summary, "pdf": pdf_bytes}
+        entry_size = len(pdf_bytes) + len(summary.encode("utf-8"))
+        if entry_size > self.max_bytes:
+            return
+        with self.lock:
+            # A project only ever has one current snapshot per report mode; older
+            # renders are dead weight, but the other modes' renders are not
+            old_key = self.project_keys.get((project_id, mode))
+            if old_key is not None and old_key != key:
+                self._remove(old_key)
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.project_keys[(project_id, mode)] = key
+            self.size += entry_size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, project_id):
+        with self.lock:
+            for (key_project_id, _), key in list(self.project_keys.items()):
+                if key_project_id == project_id:
+                    self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry["pdf"]) + len(entry["summary"].encode("utf-8"))
+        if self.project_keys.get((entry["project_id"], entry["mode"])) == key:
+            del self.project_keys[(entry["project_id"], entry["mode"])]
+
+
+report_cache = ReportCache()
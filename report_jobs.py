@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+import uuid
+import db
+import reports
+
+# Reports are rendered off the request path. Jobs live in SQLite so every
+# worker process sees the same queue, and the result survives a restart.
+WORKERS = int(os.getenv("REPORT_WORKERS", 2))
+POLL_INTERVAL = float(os.getenv("REPORT_POLL_INTERVAL", 2))
+# A job left running this long belonged to a worker that died; it is retried
+JOB_TIMEOUT = int(os.getenv("REPORT_JOB_TIMEOUT", 300))
+MAX_ATTEMPTS = int(os.getenv("REPORT_MAX_ATTEMPTS", 3))
+RETENTION = int(os.getenv("REPORT_JOB_RETENTION", 24 * 3600))
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_wakeup = threading.Condition()
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def enqueue(conn, project_id, cache_key, mode=reports.REPORT_MODE):
+    """Return (job_id, status) for the project's report, queueing one if needed.
+
+    Requests for a project and report mode collapse onto its queued or running
+    job, or onto the finished job if that was rendered from the same snapshot.
+    """
+    job = _current_job(conn, project_id, cache_key, mode)
+    if job:
+        return job
+    conn.execute("""
+        INSERT INTO report_jobs (job_id, project_id, mode, snapshot_key, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+    """, (str(uuid.uuid4()), project_id, mode, cache_key, QUEUED, time.time()))
+    conn.commit()
+    start_workers()
+    with _wakeup:
+        _wakeup.notify()
+    return _current_job(conn, project_id, cache_key, mode)
+
+
+def _current_job(conn, project_id, cache_key, mode):
+    return conn.execute("""
+        SELECT job_id, status
+        FROM report_jobs
+        WHERE project_id = ? AND mode = ? AND (status IN (?, ?) OR (status = ? AND snapshot_key = ?))
+        ORDER BY created_at DESC
+        LIMIT 1
+    """, (project_id, mode, QUEUED, RUNNING, DONE, cache_key)).fetchone()
+
+
+def job_status(conn, project_id, job_id):
+    return conn.execute("""
+        SELECT status, error
+        FROM report_jobs
+        WHERE job_id = ? AND project_id = ?
+    """, (job_id, project_id)).fetchone()
+
+
+def job_result(conn, project_id, job_id):
+    row = conn.execute("""
+        SELECT pdf
+        FROM report_jobs
+        WHERE job_id = ? AND project_id = ? AND status = ?
+    """, (job_id, project_id, DONE)).fetchone()
+    return row[0] if row else None
+
+
+def start_workers():
+    with _workers_lock:
+        if _workers:
+            return
+        for i in range(WORKERS):
+            worker = threading.Thread(target=_work, name=f"report-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _claim(conn):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("""
+            UPDATE report_jobs
+            SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                error = CASE WHEN attempts >= ? THEN 'Worker stopped responding' ELSE error END,
+                finished_at = CASE WHEN attempts >= ? THEN ? ELSE finished_at END
+            WHERE status = ? AND started_at < ?
+        """, (MAX_ATTEMPTS, FAILED, QUEUED, MAX_ATTEMPTS, MAX_ATTEMPTS, now, RUNNING, now - JOB_TIMEOUT))
+        rows = conn.execute("""
+            UPDATE report_jobs
+            SET status = ?, started_at = ?, attempts = attempts + 1
+            WHERE job_id = (SELECT job_id FROM report_jobs WHERE status = ? ORDER BY created_at LIMIT 1)
+            RETURNING job_id, project_id, mode
+        """, (RUNNING, now, QUEUED)).fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows[0] if rows else None
+
+
+def _run(conn, job_id, project_id, mode):
+    try:
+        result = reports.build_report(conn.cursor(), project_id, mode)
+        if result is None:
+            raise LookupError("project no longer exists")
+        cache_key, pdf_bytes = result
+    except Exception as e:
+        log.warning("Report Error: %s", e)
+        conn.execute(
+            "UPDATE report_jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+            (FAILED, str(e), time.time(), job_id)
+        )
+        conn.commit()
+        return
+    now = time.time()
+    # A fallback render has no snapshot key, so the next request queues a fresh job
+    conn.execute(
+        "UPDATE report_jobs SET status = ?, snapshot_key = ?, pdf = ?, error = NULL, finished_at = ? WHERE job_id = ?",
+        (DONE, cache_key, pdf_bytes, now, job_id)
+    )
+    # Only the newest finished report per project and mode is worth keeping
+    conn.execute(
+        "DELETE FROM report_jobs WHERE project_id = ? AND mode = ? AND job_id != ? AND status IN (?, ?)",
+        (project_id, mode, job_id, DONE, FAILED)
+    )
+    conn.execute(
+        "DELETE FROM report_jobs WHERE status IN (?, ?) AND finished_at < ?",
+        (DONE, FAILED, now - RETENTION)
+    )
+    conn.commit()
+
+
+def _work():
+    while True:
+        conn = db.acquire()
+        try:
+            job = _claim(conn)
+            if job:
+                _run(conn, *job)
+        except Exception as e:
+            log.exception("Report Worker Error: %s", e)
+            job = None
+        finally:
+            db.release(conn)
+        if not job:
+            with _wakeup:
+                _wakeup.wait(POLL_INTERVAL)
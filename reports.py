@@ -0,0 +1,304 @@
+import json
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime
+from fpdf import FPDF, set_global
+import gemini
+from report_cache import report_cache, snapshot_key
+from snapshot import load_snapshot
+
+log = logging.getLogger(__name__)
+
+# "llm" has Gemini write the whole summary; "template" lays out the sections
+# from project data and only asks Gemini for the closing paragraph.
+REPORT_MODES = ("llm", "template")
+REPORT_MODE = os.getenv("REPORT_MODE", "llm")
+# Template reports can skip the model entirely for a fully offline render
+TEMPLATE_SUMMARY = os.getenv("REPORT_TEMPLATE_SUMMARY", "1") != "0"
+
+
+def summary_prompt(project_name, house_details, room_details_summary, outer_areas):
+    return f"""Generate a structured summary for project '{project_name}' based on user-provided details only:
+
+House Details:
+{json.dumps(house_details, indent=2)}
+
+Rooms and Their Details:
+{json.dumps({name: details for name, details in room_details_summary.items()}, indent=2)}
+
+Outdoor Areas:
+{json.dumps(outer_areas, indent=2)}
+
+Instructions:
+- Structure the summary with sections like the reference report:
+  - 1. General Information: House type, number of stories.
+  - 2. Rooms & Spaces: Number of bedrooms, bathrooms, additional rooms (e.g., office, gym).
+  - 3. Bedroom Specifications: Details for Master Bedroom, other bedrooms (e.g., closets, windows, bathrooms).
+  - 4. Office Specifications: Size, features (e.g., desk space, lighting).
+  - 5. Gym Specifications: Size, features (e.g., cardio equipment, ventilation).
+  - 6. Living & Dining Area: Layout, special features.
+  - 7. Kitchen Preferences: Layout, lighting, storage.
+  - Overall Summary: A concise, friendly recap with emojis (e.g., 'This multi-story home with a gym and office is going to be amazing! 🏡😍').
+- Include only details explicitly provided by the user (e.g., if style is given, include it; if not, omit it).
+- Do not mention unspecified, missing, or default details.
+- Use bullet points for each section.
+- Example:
+  '1. General Information
+  - House Type: Multi-story
+  - Number of Stories: 2
+  2. Rooms & Spaces
+  - Bedrooms: 3 (Spacious)
+  - Bathrooms: 4
+  - Additional Rooms: Office, Gym
+  3. Bedroom Specifications
+  - Master Bedroom: Spacious with a custom wall texture
+  - Other Bedrooms: Slightly smaller than master, with closets
+  Overall Summary: This multi-story home with a gym and office is going to be amazing! 🏡😍'
+
+Return only the structured summary text."""
+
+
+# Core PDF fonts only cover Latin-1. Point REPORT_FONT_PATH (and optionally
+# REPORT_FONT_BOLD_PATH) at a TrueType font such as DejaVuSans to render any text.
+FONT_PATH = os.getenv("REPORT_FONT_PATH")
+FONT_BOLD_PATH = os.getenv("REPORT_FONT_BOLD_PATH")
+# Parsed TrueType metrics are pickled here so each render skips the font parse
+set_global("FPDF_CACHE_MODE", 2)
+set_global("FPDF_CACHE_DIR", os.getenv("REPORT_FONT_CACHE_DIR", tempfile.gettempdir()))
+
+LATIN1_FALLBACKS = str.maketrans({
+    "\u2018": "'", "\u2019": "'", "\u201c": '"', "\u201d": '"',
+    "\u2013": "-", "\u2014": "-", "\u2022": "-", "\u2026": "...", "\u00a0": " ",
+})
+HEADING = re.compile(r"^(?:#+\s*)?(\d+\.\s+.+|[A-Z][\w &/-]{2,40}:?)$")
+BULLET = re.compile(r"^\s*[-*\u2022]\s+(.*)$")
+ASTRAL = re.compile("[\U00010000-\U0010FFFF]")
+LINE_HEIGHT = 6
+
+
+class ReportPDF(FPDF):
+    def __init__(self):
+        super().__init__()
+        self.set_auto_page_break(True, margin=15)
+        self.unicode = bool(FONT_PATH)
+        if self.unicode:
+            self.add_font("Report", "", FONT_PATH, uni=True)
+            self.add_font("Report", "B", FONT_BOLD_PATH or FONT_PATH, uni=True)
+            self.add_font("Report", "I", FONT_PATH, uni=True)
+            self.family = "Report"
+        else:
+            self.family = "Arial"
+
+    def text_for_font(self, text):
+        text = str(text)
+        if self.unicode:
+            # fpdf 1.7 cannot embed glyphs outside the Basic Multilingual Plane (emoji)
+            return ASTRAL.sub("", text)
+        text = text.translate(LATIN1_FALLBACKS)
+        return text.encode("latin-1", "ignore").decode("latin-1")
+
+    def title_block(self, project_name):
+        self.set_font(self.family, "B", 16)
+        self.cell(0, 10, self.text_for_font(f"Summary Report: {project_name}"), ln=True, align="C")
+        self.set_font(self.family, "I", 10)
+        self.cell(0, 8, f"Generated on {datetime.now().strftime('%Y-%m-%d')}", ln=True)
+        self.ln(2)
+
+    def heading(self, text):
+        self.ln(3)
+        self.set_font(self.family, "B", 13)
+        self.multi_cell(0, 8, self.text_for_font(text))
+
+    def paragraph(self, text):
+        self.set_font(self.family, "", 11)
+        self.multi_cell(0, LINE_HEIGHT, self.text_for_font(text))
+
+    def bullet(self, text):
+        self.set_font(self.family, "", 11)
+        self.cell(6, LINE_HEIGHT, "-")
+        self.multi_cell(0, LINE_HEIGHT, self.text_for_font(text))
+
+    def table(self, rows, label_width=55):
+        self.set_font(self.family, "", 10)
+        value_width = self.w - self.l_margin - self.r_margin - label_width
+        for label, value in rows:
+            label = self.text_for_font(str(label).replace("_", " ").title())
+            value = self.text_for_font(value)
+            height = LINE_HEIGHT * max(self._line_count(label, label_width), self._line_count(value, value_width))
+            if self.get_y() + height > self.page_break_trigger:
+                self.add_page()
+            x, y = self.get_x(), self.get_y()
+            self.set_font(self.family, "B", 10)
+            self.multi_cell(label_width, LINE_HEIGHT, label)
+            self.rect(x, y, label_width, height)
+            self.set_xy(x + label_width, y)
+            self.set_font(self.family, "", 10)
+            self.multi_cell(value_width, LINE_HEIGHT, value)
+            self.rect(x + label_width, y, value_width, height)
+            self.set_xy(x, y + height)
+
+    def _line_count(self, text, width):
+        usable = width - 2 * self.c_margin
+        lines = 0
+        for paragraph in text.split("\n"):
+            lines += 1
+            line_width = 0
+            for word in paragraph.split(" "):
+                word_width = self.get_string_width(word + " ")
+                if line_width and line_width + word_width > usable:
+                    lines += 1
+                    line_width = 0
+                line_width += word_width
+        return lines
+
+    def summary_text(self, report_text):
+        # The model is asked for numbered sections with bullet points
+        for raw_line in report_text.splitlines():
+            line = raw_line.strip().replace("**", "")
+            if not line:
+                continue
+            bullet = BULLET.match(line)
+            if bullet:
+                self.bullet(bullet.group(1))
+            elif line.lower().startswith("overall summary:"):
+                self.heading("Overall Summary")
+                self.paragraph(line.split(":", 1)[1].strip())
+            elif HEADING.match(line):
+                self.heading(line.lstrip("#").strip().rstrip(":"))
+            else:
+                self.paragraph(line)
+
+    def room_tables(self, room_details_summary):
+        if not room_details_summary:
+            return
+        self.heading("Room Details")
+        for room_name, details in room_details_summary.items():
+            if not details:
+                continue
+            self.ln(1)
+            self.set_font(self.family, "B", 11)
+            self.cell(0, 8, self.text_for_font(room_name), ln=True)
+            self.table(details.items())
+
+    def to_bytes(self):
+        # fpdf 1.7 returns the document as a latin-1 str
+        return self.output(dest="S").encode("latin-1")
+
+
+def render_pdf(project_name, report_text, room_details_summary):
+    pdf = ReportPDF()
+    pdf.add_page()
+    pdf.title_block(project_name)
+    pdf.summary_text(report_text)
+    pdf.room_tables(room_details_summary)
+    return pdf.to_bytes()
+
+
+def _label(detail_type):
+    return detail_type.replace("_", " ").title()
+
+
+def template_sections(house_details, room_details_summary, outer_areas):
+    """Build the report sections directly from project data, omitting empty ones."""
+    room_names = list(room_details_summary)
+    bedrooms = [name for name in room_names if "bedroom" in name.lower()]
+    bathrooms = [name for name in room_names if "bath" in name.lower()]
+    additional = [name for name in room_names if name not in bedrooms and name not in bathrooms]
+    rooms = []
+    if bedrooms:
+        rooms.append(f"Bedrooms: {len(bedrooms)} ({', '.join(bedrooms)})")
+    if bathrooms:
+        rooms.append(f"Bathrooms: {len(bathrooms)}")
+    if additional:
+        rooms.append(f"Additional Rooms: {', '.join(additional)}")
+    sections = [
+        ("1. General Information", [f"{_label(detail_type)}: {value}" for detail_type, value in house_details.items()]),
+        ("2. Rooms & Spaces", rooms),
+        ("3. Outdoor Areas", [f"{_label(area_type)}: {description}" for area_type, description in outer_areas.items()]),
+    ]
+    return [(heading, bullets) for heading, bullets in sections if bullets]
+
+
+def overall_summary(project_name, house_details, room_details_summary, outer_areas):
+    """Return (summary, failed); failed is True when the model call fell back."""
+    fallback = f"{project_name} brings together {len(room_details_summary)} designed rooms. It is going to be a wonderful home!"
+    if not TEMPLATE_SUMMARY:
+        return fallback, False
+    prompt = f"""Write a concise, friendly 2-3 sentence recap with emojis of the house design project '{project_name}'. Mention only these user-provided details:
+
+House Details: {json.dumps(house_details)}
+Rooms: {json.dumps(room_details_summary)}
+Outdoor Areas: {json.dumps(outer_areas)}
+
+Return only the recap text."""
+    try:
+        return gemini.generate({
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": 0.4, "maxOutputTokens": 160}
+        }).strip(), False
+    except Exception as e:
+        # The structured sections do not depend on the model, so still deliver them
+        log.warning("Report Summary Error: %s", e)
+        return fallback, True
+
+
+def render_template_pdf(project_name, sections, summary, room_details_summary):
+    pdf = ReportPDF()
+    pdf.add_page()
+    pdf.title_block(project_name)
+    for heading, bullets in sections:
+        pdf.heading(heading)
+        for bullet in bullets:
+            pdf.bullet(bullet)
+    pdf.room_tables(room_details_summary)
+    pdf.heading("Overall Summary")
+    pdf.paragraph(summary)
+    return pdf.to_bytes()
+
+
+def report_key(snapshot, mode=REPORT_MODE):
+    if mode == "template" and not TEMPLATE_SUMMARY:
+        mode = "template-offline"
+    return snapshot_key(snapshot.project_name, snapshot.house_details,
+                        snapshot.room_details_summary(confirmed_only=True), snapshot.outer_areas, mode)
+
+
+def build_report(cursor, project_id, mode=REPORT_MODE):
+    """Render the summary PDF for a project's current state.
+
+    Returns (snapshot_key, pdf_bytes), or None if the project no longer exists.
+    snapshot_key is None when the summary fell back, so the render is not reused.
+    """
+    snapshot = load_snapshot(cursor, project_id)
+    if not snapshot:
+        return None
+    
+    project_name = snapshot.project_name
+    house_details = snapshot.house_details
+    outer_areas = snapshot.outer_areas
+    room_details_summary = snapshot.room_details_summary(confirmed_only=True)
+    
+    cache_key = report_key(snapshot, mode)
+    cached_report = report_cache.get(cache_key)
+    if cached_report:
+        return cache_key, cached_report['pdf']
+    
+    failed = False
+    if mode == "template":
+        report_text, failed = overall_summary(project_name, house_details, room_details_summary, outer_areas)
+        sections = template_sections(house_details, room_details_summary, outer_areas)
+        pdf_bytes = render_template_pdf(project_name, sections, report_text, room_details_summary)
+    else:
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": summary_prompt(project_name, house_details, room_details_summary, outer_areas)}]}],
+            "generationConfig": {"temperature": 0.2, "maxOutputTokens": 1024}
+        }
+        report_text = gemini.generate(payload)
+        pdf_bytes = render_pdf(project_name, report_text, room_details_summary)
+    # A fallback summary is delivered but not kept, so the next request retries the model
+    if failed:
+        return None, pdf_bytes
+    report_cache.put(project_id, cache_key, report_text, pdf_bytes, mode)
+    return cache_key, pdf_bytes
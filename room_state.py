@@ -0,0 +1,86 @@
+import re
+import local_extractor
+
+REQUIRED_DETAILS = [
+    'atmosphere', 'color_scheme', 'style', 'budget', 'activities', 'furniture',
+    'lighting', 'textures', 'dimensions', 'storage', 'flooring', 'wall_treatments',
+    'windows', 'decor', 'technology', 'accessibility', 'sustainability'
+]
+assert all(detail_type in REQUIRED_DETAILS for detail_type, _, _ in local_extractor.ROOM_DETAIL_KEYWORDS)
+
+# Stages a room moves through while it is being designed
+GATHERING = 'gathering'
+CONFIRMING = 'confirming'
+CONFIRMED = 'confirmed'
+
+# "confirmed" on its own ends the room at any stage; inside a longer message the
+# keyword only counts once every detail is in and confirmation is being asked for
+STANDALONE_CONFIRMATION = re.compile(r"^((yes|ok|okay),? )?(i )?confirm(ed)?( it| this| that)?( please)?$")
+EXPLICIT_CONFIRMATION = re.compile(r"\bconfirm(ed)?\b")
+AFFIRMATIVE = re.compile(r"^(yes|yep|yeah|sure|ok(ay)?|looks good|sounds good)\b")
+
+
+def load_state(cursor, room_id):
+    cursor.execute("""
+        SELECT stage, next_detail, confirmed, last_action
+        FROM room_design_state
+        WHERE room_id = ?
+    """, (room_id,))
+    row = cursor.fetchone()
+    if not row:
+        return {
+            'stage': GATHERING,
+            'next_detail': REQUIRED_DETAILS[0],
+            'confirmed': False,
+            'last_action': 'start',
+        }
+    return {
+        'stage': row[0],
+        'next_detail': row[1],
+        'confirmed': bool(row[2]),
+        'last_action': row[3],
+    }
+
+
+def is_confirmation(message, state):
+    # "not ready to confirm yet", "can you confirm the budget?"
+    if not message or local_extractor.is_tentative(message):
+        return False
+    text = local_extractor.normalize(message)
+    if STANDALONE_CONFIRMATION.match(text):
+        return True
+    if state['stage'] == CONFIRMING and EXPLICIT_CONFIRMATION.search(text):
+        return True
+    # A bare "yes" only counts as an answer to our own confirmation question
+    return state['last_action'] == 'confirm' and bool(AFFIRMATIVE.search(text))
+
+
+def missing_details(completed_types):
+    return [d for d in REQUIRED_DETAILS if d not in completed_types]
+
+
+def advance(state, completed_types, last_action=None):
+    missing = missing_details(completed_types)
+    state['next_detail'] = missing[0] if missing else None
+    if state['confirmed']:
+        state['stage'] = CONFIRMED
+    elif missing:
+        state['stage'] = GATHERING
+    else:
+        state['stage'] = CONFIRMING
+    if last_action:
+        state['last_action'] = last_action
+    return state
+
+
+def save_state(cursor, room_id, state):
+    cursor.execute("""
+        INSERT INTO room_design_state (room_id, stage, next_detail, confirmed, last_action)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (room_id) DO UPDATE SET
+            stage = excluded.stage,
+            next_detail = excluded.next_detail,
+            confirmed = excluded.confirmed,
+            last_action = excluded.last_action,
+            updated_at = CURRENT_TIMESTAMP
+    """, (room_id, state['stage'], state['next_detail'], int(state['confirmed']), state['last_action']))
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+import uuid
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+import db
+
+# "sqlite" keeps session state in the shared database, "cookie" uses Flask's
+# signed cookie sessions, "filesystem" keeps the old Flask-Session store.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_TTL = int(os.getenv("SESSION_TTL", 7 * 24 * 3600))
+SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", 600))
+
+
+class SqliteSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=0):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class SqliteSessionInterface(SessionInterface):
+    def __init__(self, ttl=SESSION_TTL, sweep_interval=SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.last_sweep = 0
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="housy-session")
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                conn = db.acquire()
+                try:
+                    row = conn.execute(
+                        "SELECT data, expires_at FROM sessions WHERE session_id = ? AND expires_at > ?",
+                        (sid, time.time())
+                    ).fetchone()
+                finally:
+                    db.release(conn)
+                if row:
+                    return SqliteSession(json.loads(row[0]), sid=sid, expires_at=row[1])
+        return SqliteSession(sid=str(uuid.uuid4()), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+        conn = db.acquire()
+        try:
+            if not session:
+                if session.modified and not session.new:
+                    conn.execute("DELETE FROM sessions WHERE session_id = ?", (session.sid,))
+                    conn.commit()
+                    response.delete_cookie(name, domain=domain, path=path)
+                return
+            # Unchanged sessions are only rewritten once half their lifetime has passed
+            refresh = session.expires_at - now < self.ttl / 2
+            if session.modified or session.new or refresh:
+                expires_at = now + self.ttl
+                conn.execute("""
+                    INSERT INTO sessions (session_id, data, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (session_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+                """, (session.sid, json.dumps(dict(session)), expires_at))
+                if now - self.last_sweep > self.sweep_interval:
+                    self.last_sweep = now
+                    conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+                conn.commit()
+                response.set_cookie(
+                    name,
+                    self._signer(app).sign(session.sid).decode(),
+                    max_age=self.ttl,
+                    httponly=self.get_cookie_httponly(app),
+                    domain=domain,
+                    path=path,
+                    secure=self.get_cookie_secure(app),
+                    samesite=self.get_cookie_samesite(app),
+                )
+        finally:
+            db.release(conn)
+
+
+def init_app(app, backend=None):
+    backend = backend or SESSION_BACKEND
+    if backend == "sqlite":
+        app.session_interface = SqliteSessionInterface()
+    elif backend == "filesystem":
+        from flask_session import Session
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
+    elif backend != "cookie":
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+import time
+import metrics
+
+# Profiling mode for the SQLite layer. With HOUSING_SLOW_QUERY_MS set, any
+# statement slower than that many milliseconds (0 records every statement) is
+# aggregated by fingerprint into a separate log database together with its
+# EXPLAIN QUERY PLAN, so full scans show up as data grows.
+THRESHOLD_MS = os.getenv("HOUSING_SLOW_QUERY_MS", "")
+ENABLED = THRESHOLD_MS != ""
+THRESHOLD = float(THRESHOLD_MS or 0) / 1000
+LOG_PATH = os.getenv("HOUSING_SLOW_QUERY_LOG", "slow_queries.db")
+
+# Statements EXPLAIN QUERY PLAN can describe; PRAGMA, BEGIN etc. are skipped
+PLANNED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+SORT_COLUMNS = {"total": "total_seconds", "max": "max_seconds", "calls": "calls", "avg": "total_seconds / calls"}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS slow_queries (
+        fingerprint TEXT PRIMARY KEY,
+        sample TEXT NOT NULL,
+        plan TEXT NOT NULL DEFAULT '',
+        full_scan INTEGER NOT NULL DEFAULT 0,
+        calls INTEGER NOT NULL DEFAULT 0,
+        total_seconds REAL NOT NULL DEFAULT 0,
+        max_seconds REAL NOT NULL DEFAULT 0,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL
+    )
+"""
+
+_local = threading.local()
+# Plans are looked up once per fingerprint and process
+_plans = {}
+
+
+def _log_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # A plain connection: writes to the log must not be logged themselves
+        conn = sqlite3.connect(LOG_PATH, timeout=5.0)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def format_plan(rows):
+    """Render EXPLAIN QUERY PLAN rows (id, parent, notused, detail) as an indented tree."""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return "\n".join(lines)
+
+
+def full_scan(plan):
+    # "SCAN table" without an index reads every row; covering-index scans are fine
+    return any(line.strip().startswith("SCAN ") and " INDEX" not in line for line in plan.splitlines())
+
+
+def explain(conn, sql, parameters):
+    if not sql.lstrip().upper().startswith(PLANNED):
+        return ""
+    try:
+        # The base class execute() so the lookup does not go through the instrumented cursor
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+    except sqlite3.Error:
+        return None
+    return format_plan(rows)
+
+
+def record(conn, sql, parameters, seconds):
+    if seconds < THRESHOLD:
+        return
+    statement = metrics.fingerprint(sql)
+    plan = _plans.get(statement)
+    if plan is None:
+        # executemany passes no parameters, so its plan waits for a single execute
+        plan = explain(conn, sql, parameters) if parameters is not None else None
+        if plan is not None:
+            _plans[statement] = plan
+    now = time.time()
+    try:
+        log = _log_connection()
+        log.execute("""
+            INSERT INTO slow_queries (fingerprint, sample, plan, full_scan, calls, total_seconds, max_seconds, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT (fingerprint) DO UPDATE SET
+                sample = CASE WHEN excluded.max_seconds > max_seconds THEN excluded.sample ELSE sample END,
+                plan = CASE WHEN excluded.plan != '' THEN excluded.plan ELSE plan END,
+                full_scan = CASE WHEN excluded.plan != '' THEN excluded.full_scan ELSE full_scan END,
+                calls = calls + 1,
+                total_seconds = total_seconds + excluded.total_seconds,
+                max_seconds = MAX(max_seconds, excluded.max_seconds),
+                last_seen = excluded.last_seen
+        """, (statement, sql.strip(), plan or "", int(full_scan(plan or "")), seconds, seconds, now, now))
+        log.commit()
+    except sqlite3.Error:
+        # Profiling must never break the query it is measuring
+        pass
+
+
+def top(limit=20, sort="total"):
+    if not os.path.exists(LOG_PATH):
+        return []
+    conn = sqlite3.connect(LOG_PATH)
+    try:
+        conn.execute(SCHEMA)
+        return conn.execute(f"""
+            SELECT fingerprint, plan, full_scan, calls, total_seconds, max_seconds
+            FROM slow_queries
+            ORDER BY {SORT_COLUMNS[sort]} DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+    finally:
+        conn.close()
+
+
+def reset():
+    if os.path.exists(LOG_PATH):
+        conn = sqlite3.connect(LOG_PATH)
+        try:
+            conn.execute(SCHEMA)
+            conn.execute("DELETE FROM slow_queries")
+            conn.commit()
+        finally:
+            conn.close()
+    _plans.clear()
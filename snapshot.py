@@ -0,0 +1,104 @@
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Room:
+    room_id: str
+    room_name: str
+    floor_id: str
+    floor_number: int
+    confirmed: bool
+    details: dict = field(default_factory=dict)
+    detail_rows: list = field(default_factory=list)
+
+
+@dataclass
+class ProjectSnapshot:
+    project_id: str
+    project_name: str
+    house_detail_rows: list = field(default_factory=list)
+    outer_area_rows: list = field(default_factory=list)
+    rooms: list = field(default_factory=list)
+
+    @property
+    def house_details(self):
+        return {detail_type: detail_value for detail_type, detail_value in self.house_detail_rows}
+
+    @property
+    def outer_areas(self):
+        return {area_type: description for area_type, description in self.outer_area_rows}
+
+    @property
+    def room_names(self):
+        return [room.room_name for room in self.rooms]
+
+    @property
+    def confirmed_rooms(self):
+        return [room for room in self.rooms if room.confirmed]
+
+    def room(self, room_id):
+        return next((room for room in self.rooms if room.room_id == room_id), None)
+
+    def room_details_summary(self, confirmed_only=False):
+        rooms = self.confirmed_rooms if confirmed_only else self.rooms
+        return {room.room_name: room.details for room in sorted(rooms, key=lambda r: r.room_name)}
+
+
+def load_snapshot(cursor, project_id, user_id=None, with_room_details=True):
+    if user_id is None:
+        cursor.execute("SELECT project_id, project_name FROM projects WHERE project_id = ?", (project_id,))
+    else:
+        cursor.execute(
+            "SELECT project_id, project_name FROM projects WHERE project_id = ? AND user_id = ?",
+            (project_id, user_id)
+        )
+    project = cursor.fetchone()
+    if not project:
+        return None
+
+    snapshot = ProjectSnapshot(project_id=project[0], project_name=project[1])
+
+    cursor.execute("""
+        SELECT detail_type, detail_value
+        FROM house_details
+        WHERE project_id = ?
+        ORDER BY created_at
+    """, (project_id,))
+    snapshot.house_detail_rows = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT area_type, description
+        FROM outer_areas
+        WHERE project_id = ?
+        ORDER BY created_at
+    """, (project_id,))
+    snapshot.outer_area_rows = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT r.room_id, r.room_name, r.floor_id, f.floor_number, r.confirmed
+        FROM floors f
+        JOIN rooms r ON r.floor_id = f.floor_id
+        WHERE f.project_id = ?
+        ORDER BY f.floor_number, r.room_name
+    """, (project_id,))
+    snapshot.rooms = [
+        Room(room_id=row[0], room_name=row[1], floor_id=row[2], floor_number=row[3], confirmed=bool(row[4]))
+        for row in cursor.fetchall()
+    ]
+
+    if with_room_details and snapshot.rooms:
+        rooms_by_id = {room.room_id: room for room in snapshot.rooms}
+        cursor.execute("""
+            SELECT d.room_id, d.detail_type, d.detail_value
+            FROM floors f
+            JOIN rooms r ON r.floor_id = f.floor_id
+            JOIN room_details d ON d.room_id = r.room_id
+            WHERE f.project_id = ?
+            ORDER BY d.created_at
+        """, (project_id,))
+        for room_id, detail_type, detail_value in cursor.fetchall():
+            room = rooms_by_id[room_id]
+            room.details[detail_type] = detail_value
+            room.detail_rows.append((detail_type, detail_value))
+
+    return snapshot
@@ -0,0 +1,77 @@
+import itertools
+import os
+import threading
+import time
+
+# Size is only checked every EVICT_INTERVAL writes per process, so a put is
+# normally a single upsert and the table may run that far past its limit
+EVICT_INTERVAL = int(os.getenv("SQLITE_CACHE_EVICT_INTERVAL", 200))
+
+
+class SQLiteCache:
+    """Key/value table with optional TTL and least-recently-used eviction.
+
+    The table has cache_key (primary key), a kind column, a value column,
+    created_at and last_used_at. Lookups are counted in requests_total by kind
+    and result ("hit", "miss" or "expired").
+    """
+
+    def __init__(self, table, kind_column, value_column, requests_total,
+                 max_entries, touch_interval, ttl=None):
+        self.table = table
+        self.kind_column = kind_column
+        self.value_column = value_column
+        self.requests_total = requests_total
+        self.max_entries = max_entries
+        # Recency is only rewritten this often, so most hits are read-only
+        self.touch_interval = touch_interval
+        self.ttl = ttl
+        # The first write after startup also trims, in case the limit shrank
+        self.writes = itertools.count()
+        # Hits never write: the caller's connection may hold a request's
+        # uncommitted changes. Recency is saved with the next put, which is
+        # also the only place eviction reads it.
+        self.touched = {}
+        self.lock = threading.Lock()
+
+    def get(self, conn, kind, key):
+        now = time.time()
+        row = conn.execute(
+            f"SELECT {self.value_column}, created_at, last_used_at FROM {self.table} WHERE cache_key = ?", (key,)
+        ).fetchone()
+        if row is None or (self.ttl is not None and row[1] < now - self.ttl):
+            self.requests_total.inc(1, kind, "miss" if row is None else "expired")
+            return None
+        self.requests_total.inc(1, kind, "hit")
+        if row[2] < now - self.touch_interval:
+            with self.lock:
+                self.touched[key] = now
+        return row[0]
+
+    def put(self, conn, kind, key, value):
+        now = time.time()
+        conn.execute(f"""
+            INSERT INTO {self.table} (cache_key, {self.kind_column}, {self.value_column}, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                {self.value_column} = excluded.{self.value_column},
+                created_at = excluded.created_at, last_used_at = excluded.last_used_at
+        """, (key, kind, value, now, now))
+        with self.lock:
+            touched, self.touched = self.touched, {}
+        conn.executemany(f"UPDATE {self.table} SET last_used_at = ? WHERE cache_key = ?",
+                         [(used_at, touched_key) for touched_key, used_at in touched.items()])
+        if next(self.writes) % EVICT_INTERVAL == 0:
+            self.evict(conn, now)
+        conn.commit()
+
+    def evict(self, conn, now):
+        if self.ttl is not None:
+            conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl,))
+        excess = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(f"""
+                DELETE FROM {self.table} WHERE cache_key IN (
+                    SELECT cache_key FROM {self.table} ORDER BY last_used_at LIMIT ?
+                )
+            """, (excess,))
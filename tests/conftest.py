@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main builds its app on import, so the database is pointed elsewhere first
+os.environ.setdefault("HOUSING_DB_PATH", os.path.join(tempfile.mkdtemp(), "housing_assistant.db"))
+os.environ.setdefault("SECRET_KEY", "test")
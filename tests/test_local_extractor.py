@@ -0,0 +1,99 @@
+import pytest
+import extraction
+import local_extractor
+from extraction import Detail
+
+
+@pytest.mark.parametrize("message, details", [
+    ("cozy", [Detail("atmosphere", "cozy")]),
+    ("oak flooring, pendant lights", [Detail("flooring", "oak flooring"), Detail("lighting", "pendant lights")]),
+    ("Kitchen: marble sink, granite countertops, bar stools",
+     [Detail("furniture", "marble sink, granite countertops, bar stools")]),
+    ("12x14 ft", [Detail("dimensions", "12x14 ft")]),
+    ("$5000", [Detail("budget", "$5000")]),
+    ("painted accent wall", [Detail("wall_treatments", "painted accent wall")]),
+    ("white and grey", [Detail("color_scheme", "white, grey")]),
+    ("modern minimalist", [Detail("style", "modern minimalist")]),
+    ("velvet", [Detail("textures", "velvet")]),
+    ("yes", []),
+    ("Looks good!", []),
+])
+def test_room_answers(message, details):
+    assert local_extractor.extract("room", message) == extraction.RoomExtraction(details=details)
+
+
+@pytest.mark.parametrize("message", [
+    "What lighting would you suggest?",
+    "which colors work best",
+    "how about a skylight",
+    "not sure about the colors yet",
+    "skip budget",
+    "I don't want carpet",
+    "I don’t want carpet",
+    "no windows please",
+    "maybe some plants",
+    "lighting later",
+    "unsure",
+    "one floor",
+    "2 floors",
+    "something that feels like home",
+    # Keywords from several categories, or only a modifier of something unrecognised
+    "floor-to-ceiling windows",
+    "wall-mounted TV",
+    "white oak dining table",
+    "black leather sofa",
+    "light curtains",
+    "warm white walls",
+    "light oak",
+    "",
+    "x" * (local_extractor.MAX_MESSAGE_LENGTH + 1),
+])
+def test_room_falls_back_to_llm(message):
+    assert local_extractor.extract("room", message) is None
+
+
+@pytest.mark.parametrize("message, house_details, rooms", [
+    ("2 floors, north facing", [Detail("number_of_floors", "2"), Detail("orientation", "north facing")], []),
+    ("one floor", [Detail("number_of_floors", "1")], []),
+    ("1200 sq ft plot", [Detail("plot_size", "1200 sq ft")], []),
+    ("kitchen, master bedroom and office", [], ["Kitchen", "Master Bedroom", "Office"]),
+    ("I want a modern, duplex", [Detail("architectural_style", "modern"), Detail("house_type", "duplex")], []),
+    ("yes", [], []),
+])
+def test_house_answers(message, house_details, rooms):
+    result = local_extractor.extract("house", message)
+    assert result == extraction.HouseExtraction(house_details=house_details, rooms=rooms)
+
+
+@pytest.mark.parametrize("message", [
+    "how many floors should we have?",
+    "not sure how many floors",
+    "no basement",
+    "2 bedrooms",
+    "3BHK villa",
+    "a cozy family home near the lake",
+])
+def test_house_falls_back_to_llm(message):
+    assert local_extractor.extract("house", message) is None
+
+
+@pytest.mark.parametrize("message, add, remove", [
+    ("add gym", ["Gym"], []),
+    ("remove the study", [], ["Study Room"]),
+    ("delete laundry and gym", [], ["Laundry Room", "Gym"]),
+    ("yes", [], []),
+    ("no changes", [], []),
+])
+def test_room_list_changes(message, add, remove):
+    assert local_extractor.extract("room_list", message) == extraction.RoomListChange(add=add, remove=remove)
+
+
+@pytest.mark.parametrize("message", [
+    "remove study?",
+    "should we add a gym",
+    "don't add the gym",
+    "maybe remove the office",
+    "add 2 bedrooms",
+])
+def test_room_list_falls_back_to_llm(message):
+    assert local_extractor.extract("room_list", message) is None
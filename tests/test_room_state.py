@@ -0,0 +1,38 @@
+import pytest
+import room_state
+
+
+def state(stage=room_state.GATHERING, last_action='question'):
+    return {'stage': stage, 'next_detail': None, 'confirmed': False, 'last_action': last_action}
+
+
+@pytest.mark.parametrize("message, current", [
+    ("confirmed", state()),
+    ("Confirm", state()),
+    ("yes, confirm it", state()),
+    ("I confirm.", state()),
+    ("Looks great, confirmed!", state(room_state.CONFIRMING, 'confirm')),
+    ("please confirm the design", state(room_state.CONFIRMING, 'confirm')),
+    ("yes", state(room_state.CONFIRMING, 'confirm')),
+    ("Sounds good", state(room_state.CONFIRMING, 'confirm')),
+])
+def test_confirmation(message, current):
+    assert room_state.is_confirmation(message, current)
+
+
+@pytest.mark.parametrize("message, current", [
+    ("not ready to confirm yet", state(room_state.CONFIRMING, 'confirm')),
+    ("can you confirm the budget?", state(room_state.CONFIRMING, 'confirm')),
+    ("please don't confirm", state(room_state.CONFIRMING, 'confirm')),
+    ("please don’t confirm", state(room_state.CONFIRMING, 'confirm')),
+    ("no", state(room_state.CONFIRMING, 'confirm')),
+    # The keyword inside a longer answer only counts at the confirmation step
+    ("confirm the budget is $5000", state()),
+    ("I confirmed the lighting with my partner", state()),
+    # A bare "yes" answers a design question, not the confirmation
+    ("yes", state()),
+    ("", state()),
+    (None, state()),
+])
+def test_not_confirmation(message, current):
+    assert not room_state.is_confirmation(message, current)
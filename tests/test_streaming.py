@@ -0,0 +1,138 @@
+import threading
+import time
+import uuid
+import pytest
+import db
+import gemini
+import main
+
+STREAMS = 4
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    def generate(payload):
+        text = payload["contents"][-1]["parts"][0]["text"]
+        if "Return JSON" in text:
+            return '{"house_details": [], "rooms": ["Kitchen"], "room_details": [], "details": [], "add": [], "remove": []}'
+        return "Reply text"
+    monkeypatch.setattr(gemini, "generate", generate)
+
+
+@pytest.fixture
+def borrowed(monkeypatch):
+    # Connections currently handed out by the pool
+    borrowed = set()
+    lock = threading.Lock()
+    acquire, release = db.acquire, db.release
+    
+    def tracked_acquire():
+        conn = acquire()
+        with lock:
+            borrowed.add(conn)
+        return conn
+    
+    def tracked_release(conn):
+        with lock:
+            assert conn in borrowed, "connection released twice"
+            borrowed.discard(conn)
+        release(conn)
+    
+    monkeypatch.setattr(db, "acquire", tracked_acquire)
+    monkeypatch.setattr(db, "release", tracked_release)
+    return borrowed
+
+
+def room_client():
+    client = main.app.test_client()
+    client.post("/register", data={"email": f"{uuid.uuid4().hex}@example.com", "password": "password1"})
+    project_id = client.post("/create-project", data={"project_name": "P"}).headers["Location"].split("/")[2]
+    client.post(f"/api/project/{project_id}/setup-chat", json={"message": "kitchen"})
+    client.post(f"/api/project/{project_id}/confirm-rooms", json={"message": "yes"})
+    conn = db.connect()
+    try:
+        room_id = conn.execute("""
+            SELECT r.room_id FROM rooms r JOIN floors f ON r.floor_id = f.floor_id WHERE f.project_id = ?
+        """, (project_id,)).fetchone()[0]
+    finally:
+        conn.close()
+    return client, room_id
+
+
+def test_concurrent_streams_keep_their_connections(fake_gemini, borrowed, monkeypatch):
+    clients = [room_client() for _ in range(STREAMS)]
+    in_flight = threading.Barrier(STREAMS, timeout=10)
+    held = []
+    
+    def stream(payload):
+        # Every request has returned from its view by now; each stream must
+        # still hold the connection its reply is saved on
+        in_flight.wait()
+        held.append(len(borrowed))
+        for chunk in ("Reply ", "text"):
+            time.sleep(0.01)
+            yield chunk
+    
+    monkeypatch.setattr(gemini, "stream", stream)
+    errors = []
+    
+    def chat(client, room_id):
+        try:
+            with client.post(f"/api/chat/{room_id}/stream", json={"message": "modern style"}) as response:
+                body = response.get_data(as_text=True)
+            assert 'event: done' in body
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=chat, args=client) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert not errors
+    assert min(held) >= STREAMS
+    assert not borrowed
+    conn = db.connect()
+    try:
+        for _, room_id in clients:
+            messages = conn.execute(
+                "SELECT sender, message FROM chat_history WHERE room_id = ? AND sender = 'assistant' ORDER BY rowid DESC",
+                (room_id,)
+            ).fetchall()
+            assert messages[0] == ("assistant", "Reply text")
+    finally:
+        conn.close()
+
+
+def test_disconnect_mid_stream_still_saves_the_turn(fake_gemini, borrowed, monkeypatch):
+    client, room_id = room_client()
+    
+    def stream(payload):
+        yield "Love "
+        yield "the style"
+    
+    monkeypatch.setattr(gemini, "stream", stream)
+    response = client.post(f"/api/chat/{room_id}/stream", json={"message": "modern"}, buffered=False)
+    body = iter(response.response)
+    assert b"Love " in next(body)
+    response.close()
+    
+    assert not borrowed
+    conn = db.connect()
+    try:
+        messages = conn.execute(
+            "SELECT sender, message FROM chat_history WHERE room_id = ? ORDER BY rowid DESC LIMIT 2", (room_id,)
+        ).fetchall()
+        answers = conn.execute(
+            "SELECT question_type, answer FROM room_design_questions WHERE room_id = ?", (room_id,)
+        ).fetchall()
+        last_action = conn.execute(
+            "SELECT last_action FROM room_design_state WHERE room_id = ?", (room_id,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert messages == [("assistant", "Love "), ("user", "modern")]
+    assert ("style", "modern") in answers
+    # A cut-off reply moves the state like a failed one does
+    assert last_action != "question"